@@ -0,0 +1,149 @@
+import os
+import numpy as np
+from twscrape.logger import logger
+from segment_store import INDEX_SUFFIX, fsync_folder, list_segments, read_index, recover_open_segments
+from id_batches import sorted_contains
+
+# Checkpoint files kept next to the collected data:
+#   .collected_ids       sorted little-endian int64 array of collected IDs (memory-mapped)
+#   .collected_log       int64 IDs appended since the last compaction
+#   .collected_segments  names of the sealed segments already recorded in the checkpoint
+IDS_FILE = ".collected_ids"
+LOG_FILE = ".collected_log"
+SEGMENTS_FILE = ".collected_segments"
+
+ID_DTYPE = np.dtype("<i8")
+
+
+class CollectedIndex:
+    """Persistent set of collected IDs that can be checked without listing the output folder."""
+
+    def __init__(self, folder, rebuild=None):
+        self.folder = folder
+        self.ids_path = os.path.join(folder, IDS_FILE)
+        self.log_path = os.path.join(folder, LOG_FILE)
+        self.segments_path = os.path.join(folder, SEGMENTS_FILE)
+
+        os.makedirs(folder, exist_ok=True)
+
+        if not os.path.exists(self.ids_path):
+            self._rebuild(rebuild)
+
+        self._open_sorted_ids()
+        self._pending = self._read_log()
+        self._segments = self._read_segments()
+        self._log_file = open(self.log_path, "ab")
+
+        self._sync_segments()
+
+    def _rebuild(self, rebuild):
+        """Create the checkpoint from the existing output folder (one-time migration)."""
+        logger.info(f"No checkpoint found in '{self.folder}'. Building it from the existing files...")
+        collected_ids = rebuild(self.folder) if rebuild else set()
+        self._write_sorted_ids(np.sort(np.fromiter(collected_ids, dtype=ID_DTYPE, count=len(collected_ids))))
+
+        # Segments present now are covered by the rebuilt ID list
+        with open(self.segments_path, "w") as f:
+            f.writelines(f"{name}\n" for name in list_segments(self.folder))
+
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        logger.info(f"Checkpoint built with {len(collected_ids)} collected IDs.")
+
+    def _write_sorted_ids(self, sorted_ids):
+        tmp_path = f"{self.ids_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            sorted_ids.astype(ID_DTYPE, copy=False).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.ids_path)
+        fsync_folder(self.folder)
+
+    def _open_sorted_ids(self):
+        if os.path.getsize(self.ids_path) == 0:
+            self._sorted_ids = np.empty(0, dtype=ID_DTYPE)
+        else:
+            self._sorted_ids = np.memmap(self.ids_path, dtype=ID_DTYPE, mode="r")
+
+    def _read_log(self):
+        if not os.path.exists(self.log_path):
+            return set()
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        # Ignore a partially written trailing ID
+        data = data[:len(data) - len(data) % ID_DTYPE.itemsize]
+        return set(np.frombuffer(data, dtype=ID_DTYPE).tolist())
+
+    def _pending_array(self):
+        return np.sort(np.fromiter(self._pending, dtype=ID_DTYPE, count=len(self._pending)))
+
+    def _read_segments(self):
+        if not os.path.exists(self.segments_path):
+            return set()
+        with open(self.segments_path, "r") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _sync_segments(self):
+        """Record sealed segments that are not yet in the checkpoint, e.g. after a crash."""
+        recover_open_segments(self.folder)
+        for name in list_segments(self.folder):
+            if name not in self._segments:
+                entries = read_index(os.path.join(self.folder, name + INDEX_SUFFIX))
+                self.record_segment(name, [entry[0] for entry in entries])
+                logger.info(f"Added segment {name} to the checkpoint.")
+
+    def __contains__(self, record_id):
+        if record_id in self._pending:
+            return True
+        pos = int(np.searchsorted(self._sorted_ids, record_id))
+        return pos < len(self._sorted_ids) and self._sorted_ids[pos] == record_id
+
+    def __len__(self):
+        return len(self._sorted_ids) + len(self._pending)
+
+    def add_many(self, record_ids):
+        """Durably append newly collected IDs to the checkpoint log."""
+        new_ids = [int(record_id) for record_id in record_ids if record_id not in self]
+        if not new_ids:
+            return
+        self._log_file.write(np.array(new_ids, dtype=ID_DTYPE).tobytes())
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+        self._pending.update(new_ids)
+
+    def record_segment(self, name, record_ids):
+        """Add the IDs of a sealed segment and remember that the segment is covered."""
+        self.add_many(record_ids)
+        with open(self.segments_path, "a") as f:
+            f.write(f"{name}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._segments.add(name)
+
+    def remaining(self, record_ids):
+        """Return the IDs that have not been collected yet as an int64 array, preserving their order."""
+        record_ids = np.asarray(record_ids, dtype=ID_DTYPE)
+        collected = sorted_contains(self._sorted_ids, record_ids)
+        if self._pending:
+            collected |= sorted_contains(self._pending_array(), record_ids)
+        return record_ids[~collected]
+
+    def compact(self):
+        """Merge the log into the sorted ID file and truncate the log."""
+        if not self._pending:
+            return
+        merged = np.union1d(self._sorted_ids, self._pending_array())
+        self._sorted_ids = None  # Release the memory map before replacing the file
+        self._write_sorted_ids(merged)
+        self._open_sorted_ids()
+
+        self._log_file.close()
+        self._log_file = open(self.log_path, "wb")
+        os.fsync(self._log_file.fileno())
+        self._pending = set()
+
+    def close(self):
+        """Compact the checkpoint and release its files."""
+        self.compact()
+        self._log_file.close()
+        self._sorted_ids = None
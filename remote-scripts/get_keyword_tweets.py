@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+from twscrape import API
+from twscrape.logger import set_log_level, logger
+from twscrape.models import parse_tweets
+from twscrape.utils import find_obj
+from pool_utils import QueueGate, get_active_account_count
+from segment_store import SegmentWriter, get_collected_ids
+from checkpoint import CollectedIndex
+from log_utils import add_log_file
+
+# Set log level globally
+set_log_level("DEBUG")
+
+QUEUE = "SearchTimeline"
+CURSORS_DB = "keyword_cursors.db"  # Per-keyword search position, kept outside the gathered output folder
+
+
+def load_keywords(batch_no_str, keyword_file=None):
+    """Load the keywords of a batch from keyword_batches/keyword_batch_NNN.json (a JSON list of queries)."""
+    path = keyword_file or os.path.join("keyword_batches", f"keyword_batch_{batch_no_str}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        keywords = json.load(f)
+    if isinstance(keywords, dict):
+        keywords = keywords.get("keywords", [])
+    # Keep the order but drop empty and repeated keywords
+    return list(dict.fromkeys(str(keyword).strip() for keyword in keywords if str(keyword).strip()))
+
+
+def connect_cursors(db_path=CURSORS_DB):
+    """Open the keyword cursor database.
+
+    since_id is the newest tweet ID of the last completed search of a keyword. While a search is
+    paginated, newest_id and cursor hold its progress so an interrupted search resumes from its last page.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS keywords (
+            keyword TEXT PRIMARY KEY,
+            since_id INTEGER,
+            newest_id INTEGER,
+            cursor TEXT,
+            tweet_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def load_cursor(conn, keyword):
+    row = conn.execute("SELECT * FROM keywords WHERE keyword = ?", (keyword,)).fetchone()
+    if row is None:
+        return {"since_id": None, "newest_id": None, "cursor": None, "tweet_count": 0}
+    return dict(row)
+
+
+def save_cursor(conn, keyword, state):
+    conn.execute(
+        "INSERT OR REPLACE INTO keywords (keyword, since_id, newest_id, cursor, tweet_count) VALUES (?, ?, ?, ?, ?)",
+        (keyword, state["since_id"], state["newest_id"], state["cursor"], state["tweet_count"])
+    )
+    conn.commit()
+
+
+def build_query(keyword, since_id):
+    """Restrict the search to tweets newer than the last completed search."""
+    return f"{keyword} since_id:{since_id}" if since_id else keyword
+
+
+async def search_keyword(api, writer, conn, keyword, limit=-1, progress=None):
+    """Paginate the search results of a keyword, newest first, and advance its since_id once done.
+
+    Returns the number of tweets found in this run.
+    """
+    state = load_cursor(conn, keyword)
+    query = build_query(keyword, state["since_id"])
+    if state["cursor"]:
+        logger.info(f"Resuming search for '{keyword}' after {state['tweet_count']} tweets.")
+
+    kv = {"cursor": state["cursor"]} if state["cursor"] else None
+    found = 0
+    async for rep in api.search_raw(query, limit=limit, kv=kv):
+        page = rep.json()
+        for tweet in parse_tweets(page, limit):
+            record = tweet.dict()
+            record["keyword"] = keyword  # A tweet can match several keywords
+            writer.write(tweet.id, json.dumps(record, default=str))
+            state["newest_id"] = max(state["newest_id"] or 0, tweet.id)
+            state["tweet_count"] += 1
+            found += 1
+
+        # Persist the page before its cursor so a restart never skips tweets
+        writer.flush()
+        cursor = find_obj(page, lambda x: x.get("cursorType") == "Bottom")
+        state["cursor"] = cursor.get("value") if cursor else None
+        save_cursor(conn, keyword, state)
+        if progress is not None:
+            progress["pages"] += 1
+
+    if limit > 0 and found >= limit and state["cursor"]:
+        # Stopped by --limit, not by running out of pages: the next run continues from the saved cursor
+        logger.info(f"Reached the limit of {limit} tweets for '{keyword}'. The next run continues the search.")
+        return found
+
+    # The search reached the last known tweet: the next run only asks for newer ones
+    state["since_id"] = state["newest_id"] or state["since_id"]
+    state.update(newest_id=None, cursor=None, tweet_count=0)
+    save_cursor(conn, keyword, state)
+    return found
+
+
+async def worker(api, keywords, writer, conn, progress, gate, limit):
+    """Search one keyword at a time until the keywords run out."""
+    while True:
+        keyword = next(keywords, None)
+        if keyword is None:
+            break
+
+        try:
+            async with gate:
+                found = await search_keyword(api, writer, conn, keyword, limit, progress)
+            logger.info(f"Keyword '{keyword}': {found} new tweets.")
+        except Exception as e:
+            logger.error(f"Error searching keyword '{keyword}': {e}")
+        progress["keywords"] += 1
+
+
+async def run_job(api, batch_no_str, num_workers=None, gate=None, keyword_file=None, compression=None, limit=-1):
+    """Search the keywords of a batch concurrently, one keyword per worker."""
+    add_log_file(f"logs/keyword_tweets_{batch_no_str}.log")  # Save logs to a file
+
+    keyword_tweets_folder = "keyword_tweets"
+    os.makedirs(keyword_tweets_folder, exist_ok=True)
+
+    keywords = load_keywords(batch_no_str, keyword_file)
+    if not keywords:
+        logger.info("No keywords to search. Exiting.")
+        return
+    logger.info(f"Total keywords loaded: {len(keywords)}")
+
+    # The checkpoint is only used for progress counts (run_remote_scripts.py --status)
+    checkpoint = CollectedIndex(keyword_tweets_folder, rebuild=get_collected_ids)
+    logger.info(f"Keyword tweets collected so far: {len(checkpoint)}")
+
+    # One worker per active account keeps every logged-in account busy
+    if num_workers is None:
+        num_workers = await get_active_account_count(api, QUEUE)
+    num_workers = max(1, min(num_workers, len(keywords)))
+    logger.info(f"Searching keywords with {num_workers} concurrent workers.")
+
+    conn = connect_cursors()
+    progress = {"keywords": 0, "pages": 0}
+    gate = gate or QueueGate(api, QUEUE)
+    writer = SegmentWriter(keyword_tweets_folder, "keyword_tweets", on_seal=checkpoint.record_segment,
+                           compression=compression)
+
+    # Workers share one keyword iterator, so every keyword is searched exactly once
+    keyword_iter = iter(keywords)
+    try:
+        await asyncio.gather(*[
+            worker(api, keyword_iter, writer, conn, progress, gate, limit) for _ in range(num_workers)
+        ])
+    finally:
+        writer.close()
+        checkpoint.close()
+        conn.close()
+
+    logger.info(f"Finished searching {progress['keywords']} keywords ({progress['pages']} pages). "
+                f"Segments saved to the '{keyword_tweets_folder}' folder.")
+
+
+async def main(batch_no_str, num_workers=None, keyword_file=None, compression=None, limit=-1):
+    """Main function to search keyword tweets."""
+    await run_job(API(), batch_no_str, num_workers, keyword_file=keyword_file, compression=compression, limit=limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search tweets for a batch of keywords.")
+    parser.add_argument("batch_no", help="Batch number of the keyword_batches/keyword_batch_NNN.json file to process.")
+    parser.add_argument("--keyword-file", default=None,
+                        help="Keyword file to process (default: keyword_batches/keyword_batch_NNN.json).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of keywords searched at once (default: number of active accounts).")
+    parser.add_argument("--limit", type=int, default=-1,
+                        help="Maximum tweets per keyword and run; the next run continues where it stopped (default: no limit).")
+    parser.add_argument("--compress", choices=["zstd"], default=None,
+                        help="Write zstd-compressed segments with seekable frames (requires zstandard).")
+    args = parser.parse_args()
+
+    # Validate and parse batch number
+    batch_no = args.batch_no
+    if not batch_no.isdigit():
+        logger.error("<batch_no> must be an integer.")
+        sys.exit(1)
+
+    if args.workers is not None and args.workers < 1:
+        logger.error("--workers must be a positive integer.")
+        sys.exit(1)
+
+    batch_no = int(batch_no)
+    batch_no_str = str(batch_no).zfill(3)
+
+    try:
+        asyncio.run(main(batch_no_str, args.workers, args.keyword_file, args.compress, args.limit))
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
@@ -1,92 +1,160 @@
+import argparse
 import asyncio
 from twscrape import API
 from twscrape.logger import set_log_level, logger
 import os
 import sys
+from pool_utils import QueueGate, get_active_account_count
+from segment_store import SegmentWriter, get_collected_ids
+from checkpoint import CollectedIndex
+from id_batches import iter_ids, load_id_array
+from log_utils import add_log_file
+from job_queue import submit_job
+from lease_client import LeaseClient, process_leases
 
 # Set log level globally
 set_log_level("DEBUG")
 
+QUEUE = "TweetDetail"
 
-def load_tweet_data(batch_no_str):
+
+def load_tweet_data(batch_no_str, id_file=None, leased=False):
     """Load tweet data, check collected tweets, and prepare file paths."""
-    logger.add(f"logs/tweets_{batch_no_str}.log", level="DEBUG")  # Save logs to a file
+    add_log_file(f"logs/tweets_{batch_no_str}.log")  # Save logs to a file
 
     # Create "tweets" folder if it doesn't exist
     tweets_folder = "tweets"
     os.makedirs(tweets_folder, exist_ok=True)
 
-    # Load tweet IDs
-    with open(f"tweet_ids_{batch_no_str}.txt", "r") as f:
-        tweet_ids = f.read().strip().split("\n")
-
-    tweet_ids = [int(tweet_id) for tweet_id in tweet_ids]
+    # Check already collected tweet IDs against the persistent checkpoint
+    checkpoint = CollectedIndex(tweets_folder, rebuild=get_collected_ids)
 
-    # Check already collected tweet IDs
-    def get_collected_tweet_ids(folder):
-        """Retrieve a set of tweet IDs already collected."""
-        collected_ids = set()
-        for filename in os.listdir(folder):
-            if filename.endswith(".json"):
-                try:
-                    collected_ids.add(int(filename.replace(".json", "")))
-                except ValueError:
-                    logger.warning(f"Invalid file name in tweets folder: {filename}")
-        return collected_ids
+    if leased:
+        # IDs are leased from the coordinator instead of read from the batch file
+        logger.info(f"Tweet IDs collected so far: {len(checkpoint)}")
+        return tweets_folder, None, checkpoint
 
-    collected_tweet_ids = get_collected_tweet_ids(tweets_folder)
+    # Load tweet IDs as an int64 array (cached as a memory-mapped .npy sidecar)
+    tweet_ids = load_id_array(id_file or f"tweet_ids_{batch_no_str}.txt")
 
     # Filter out already collected tweet IDs
-    remaining_tweet_ids = [tweet_id for tweet_id in tweet_ids if tweet_id not in collected_tweet_ids]
-
-    if not remaining_tweet_ids:
-        logger.info("No new tweets to fetch. Exiting.")
-        sys.exit(0)
+    remaining_tweet_ids = checkpoint.remaining(tweet_ids)
 
     logger.info(f"Total tweet IDs loaded: {len(tweet_ids)}")
     logger.info(f"Remaining tweet IDs to fetch: {len(remaining_tweet_ids)}")
 
-    return tweets_folder, remaining_tweet_ids
+    return tweets_folder, remaining_tweet_ids, checkpoint
 
 
-async def main(batch_no_str):
-    """Main function to fetch tweet details."""
-    tweets_folder, remaining_tweet_ids = load_tweet_data(batch_no_str)
-    api = API()
+async def fetch_tweet(api, writer, tweet_id):
+    """Fetch a single tweet and append it to the tweets segment store."""
+    try:
+        tweet = await api.tweet_details(tweet_id)
+        if tweet:
+            writer.write(tweet_id, tweet.json())  # One JSONL record per tweet
+    except Exception as e:
+        logger.error(f"Error fetching tweet {tweet_id}: {e}")
 
-    # Fetch tweet details and save each tweet in a separate JSON file
-    for idx, tweet_id in enumerate(remaining_tweet_ids, start=1):
-        # Log progress every 1,000 tweets
-        if idx % 1_000 == 0:
-            logger.info(f"{idx} tweets processed so far...")
 
+async def worker(api, queue, writer, progress, gate):
+    """Take tweet IDs from the queue and fetch them until the queue is drained."""
+    while True:
+        tweet_id = await queue.get()
         try:
-            tweet = await api.tweet_details(tweet_id)
-            if tweet:
-                file_path = os.path.join(tweets_folder, f"{tweet_id}.json")  # Create file path
-                with open(file_path, "w") as f:
-                    f.write(tweet.json())  # Write tweet to individual JSON file
-        except Exception as e:
-            logger.error(f"Error fetching tweet {tweet_id}: {e}")
+            async with gate:
+                await fetch_tweet(api, writer, tweet_id)
+            progress["processed"] += 1
+
+            # Log progress every 1,000 tweets
+            if progress["processed"] % 1_000 == 0:
+                logger.info(f"{progress['processed']} tweets processed so far...")
+        finally:
+            queue.task_done()
+
+
+async def run_job(api, batch_no_str, num_workers=None, gate=None, id_file=None, compression=None, coordinator=None):
+    """Fetch tweet details for a batch with a pool of concurrent workers."""
+    # With a coordinator, IDs are pulled lease by lease instead of read from the batch file
+    leases = LeaseClient(coordinator, "tweets") if coordinator else None
+    tweets_folder, remaining_tweet_ids, checkpoint = load_tweet_data(batch_no_str, id_file, leased=leases is not None)
+
+    if leases is None and len(remaining_tweet_ids) == 0:
+        checkpoint.close()
+        logger.info("No new tweets to fetch. Exiting.")
+        return
+
+    # One worker per active account keeps every logged-in account busy
+    if num_workers is None:
+        num_workers = await get_active_account_count(api, QUEUE)
+    num_workers = max(1, num_workers if leases else min(num_workers, len(remaining_tweet_ids)))
+    logger.info(f"Fetching tweet details with {num_workers} concurrent workers.")
+
+    # Bounded queue so that workers are fed without materializing extra copies of the IDs
+    queue = asyncio.Queue(maxsize=num_workers * 2)
+    progress = {"processed": 0}
+    gate = gate or QueueGate(api, QUEUE)
+    writer = SegmentWriter(tweets_folder, "tweets", on_seal=checkpoint.record_segment, compression=compression)
+    workers = [asyncio.create_task(worker(api, queue, writer, progress, gate)) for _ in range(num_workers)]
 
-    logger.info(f"Finished fetching tweet details. Files saved to the '{tweets_folder}' folder.")
+    try:
+        if leases is None:
+            for tweet_id in iter_ids(remaining_tweet_ids):
+                await queue.put(tweet_id)
+            await queue.join()
+        else:
+            await process_leases(leases, queue, writer, checkpoint.remaining)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        writer.close()
+        checkpoint.close()
+
+    logger.info(f"Finished fetching tweet details. Segments saved to the '{tweets_folder}' folder.")
+
+
+async def main(batch_no_str, num_workers=None, id_file=None, compression=None, coordinator=None):
+    """Main function to fetch tweet details."""
+    await run_job(API(), batch_no_str, num_workers, id_file=id_file, compression=compression,
+                  coordinator=coordinator)
 
 
 if __name__ == "__main__":
-    # Validate and parse batch number
-    if len(sys.argv) != 2:
-        logger.error("Usage: python script.py <batch_no>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Fetch tweet details for a batch of tweet IDs.")
+    parser.add_argument("batch_no", help="Batch number of the tweet_ids_NNN.txt file to process.")
+    parser.add_argument("--id-file", default=None,
+                        help="ID file to process (default: tweet_ids_NNN.txt).")
+    parser.add_argument("--submit", action="store_true",
+                        help="Queue the job for worker_daemon.py instead of running it now.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent requests (default: number of active accounts).")
+    parser.add_argument("--compress", choices=["zstd"], default=None,
+                        help="Write zstd-compressed segments with seekable frames (requires zstandard).")
+    parser.add_argument("--coordinator", default=None,
+                        help="URL of the lease coordinator to pull ID leases from instead of the batch file.")
+    args = parser.parse_args()
 
-    batch_no = sys.argv[1]
+    # Validate and parse batch number
+    batch_no = args.batch_no
     if not batch_no.isdigit():
         logger.error("<batch_no> must be an integer.")
         sys.exit(1)
 
+    if args.workers is not None and args.workers < 1:
+        logger.error("--workers must be a positive integer.")
+        sys.exit(1)
+
     batch_no = int(batch_no)
     batch_no_str = str(batch_no).zfill(3)
 
+    if args.submit:
+        job_id = submit_job("tweets", batch_no_str, args.id_file, options={
+            "num_workers": args.workers, "compression": args.compress, "coordinator": args.coordinator,
+        })
+        logger.info(f"Submitted tweets job {job_id} for batch {batch_no_str} to the worker daemon.")
+        sys.exit(0)
+
     try:
-        asyncio.run(main(batch_no_str))  # Pass batch_no_str to the main function
+        asyncio.run(main(batch_no_str, args.workers, args.id_file, args.compress, args.coordinator))  # Pass batch_no_str to the main function
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
@@ -1,92 +1,227 @@
+import argparse
 import asyncio
+import functools
 from twscrape import API
 from twscrape.logger import set_log_level, logger
 import os
 import sys
+from pool_utils import QueueGate, get_active_account_count
+from segment_store import SegmentWriter, get_collected_ids
+from checkpoint import CollectedIndex
+from id_batches import iter_ids, load_id_array
+from log_utils import add_log_file
+from job_queue import submit_job
+from lease_client import LeaseClient, process_leases
+from harvest_users import harvest_users
+from profile_cache import EVICTION_POLICIES, MAX_ENTRIES, ProfileCache, select_stale_users
 
 # Set log level globally
 set_log_level("DEBUG")
 
+QUEUE = "UserByRestId"
 
-def load_user_data(batch_no_str):
+
+def load_user_data(batch_no_str, id_file=None, leased=False, refresh=False):
     """Load user data, check collected users, and prepare file paths."""
-    logger.add(f"logs/user_infos_{batch_no_str}.log", level="DEBUG")  # Save logs to a file
+    add_log_file(f"logs/user_infos_{batch_no_str}.log")  # Save logs to a file
 
     # Create "user_infos" folder if it doesn't exist
     user_infos_folder = "user_infos"
     os.makedirs(user_infos_folder, exist_ok=True)
 
-    # Load user IDs
-    with open(f"user_ids_{batch_no_str}.txt", "r") as f:
-        user_ids = f.read().strip().split("\n")
+    # Check already collected user IDs against the persistent checkpoint
+    checkpoint = CollectedIndex(user_infos_folder, rebuild=get_collected_ids)
 
-    user_ids = [int(user_id) for user_id in user_ids]
+    if leased:
+        # IDs are leased from the coordinator instead of read from the batch file
+        logger.info(f"User IDs collected so far: {len(checkpoint)}")
+        return user_infos_folder, None, checkpoint
 
-    # Check already collected user IDs
-    def get_collected_user_ids(folder):
-        """Retrieve a set of user IDs already collected."""
-        collected_ids = set()
-        for filename in os.listdir(folder):
-            if filename.endswith(".json"):
-                try:
-                    collected_ids.add(int(filename.replace(".json", "")))
-                except ValueError:
-                    logger.warning(f"Invalid file name in user infos folder: {filename}")
-        return collected_ids
+    # Load user IDs as an int64 array (cached as a memory-mapped .npy sidecar)
+    user_ids = load_id_array(id_file or f"user_ids_{batch_no_str}.txt")
 
-    collected_user_ids = get_collected_user_ids(user_infos_folder)
+    if refresh:
+        # Every user is checked against the profile cache, so stale profiles are fetched again
+        logger.info(f"Total user IDs loaded: {len(user_ids)}")
+        return user_infos_folder, user_ids, checkpoint
 
     # Filter out already collected user IDs
-    remaining_user_ids = [user_id for user_id in user_ids if user_id not in collected_user_ids]
-
-    if not remaining_user_ids:
-        logger.info("No new users to fetch. Exiting.")
-        sys.exit(0)
+    remaining_user_ids = checkpoint.remaining(user_ids)
 
     logger.info(f"Total user IDs loaded: {len(user_ids)}")
     logger.info(f"Remaining user IDs to fetch: {len(remaining_user_ids)}")
 
-    return user_infos_folder, remaining_user_ids
+    return user_infos_folder, remaining_user_ids, checkpoint
 
 
-async def main(batch_no_str):
-    """Main function to fetch user details."""
-    user_infos_folder, remaining_user_ids = load_user_data(batch_no_str)
-    api = API()
+async def fetch_user(api, writer, user_id, cache=None):
+    """Fetch a single user and append it to the user infos segment store."""
+    try:
+        user_info = await api.user_by_id(user_id)
+        if user_info:
+            profile = user_info.json()
+            writer.write(user_id, profile)  # One JSONL record per user
+            if cache is not None:
+                cache.put(user_id, profile)
+    except Exception as e:
+        logger.error(f"Error fetching user {user_id}: {e}")
 
-    # Fetch user info and save each user info in a separate JSON file
-    for idx, user_id in enumerate(remaining_user_ids, start=1):
-        # Log progress every 1,000 users
-        if idx % 1_000 == 0:
-            logger.info(f"{idx} users processed so far...")
 
+async def worker(api, queue, writer, progress, gate, cache=None):
+    """Take user IDs from the queue and fetch them until the queue is drained."""
+    while True:
+        user_id = await queue.get()
         try:
-            user_info = await api.user_by_id(user_id)
-            if user_info:
-                file_path = os.path.join(user_infos_folder, f"{user_id}.json")  # Create file path
-                with open(file_path, "w") as f:
-                    f.write(user_info.json())  # Write user info to individual JSON file
-        except Exception as e:
-            logger.error(f"Error fetching user {user_id}: {e}")
+            async with gate:
+                await fetch_user(api, writer, user_id, cache)
+            progress["processed"] += 1
+
+            # Log progress every 1,000 users
+            if progress["processed"] % 1_000 == 0:
+                logger.info(f"{progress['processed']} users processed so far...")
+        finally:
+            queue.task_done()
+
+
+async def run_job(api, batch_no_str, num_workers=None, gate=None, id_file=None, compression=None, coordinator=None,
+                  cache=None, harvest=False):
+    """Fetch user details for a batch with a pool of concurrent workers."""
+    # With a coordinator, IDs are pulled lease by lease instead of read from the batch file
+    leases = LeaseClient(coordinator, "user_infos") if coordinator else None
+    user_infos_folder, remaining_user_ids, checkpoint = load_user_data(batch_no_str, id_file, leased=leases is not None,
+                                                                       refresh=cache is not None)
+
+    if cache is not None:
+        # Profiles collected before the cache was enabled count as fetched when their segment was sealed
+        cache.seed(user_infos_folder)
+
+    if harvest:
+        # Users embedded in already collected tweets do not need a UserByRestId request
+        harvest_users(compression=compression, cache=cache, checkpoint=checkpoint)
+        if leases is None and cache is None:
+            remaining_user_ids = checkpoint.remaining(remaining_user_ids)
+            logger.info(f"Remaining user IDs to fetch after harvesting: {len(remaining_user_ids)}")
+
+    on_seal = checkpoint.record_segment
+    if cache is not None:
+        on_seal = cache.skip_seeding(on_seal, user_infos_folder)
+    writer = SegmentWriter(user_infos_folder, "user_infos", on_seal=on_seal, compression=compression)
+
+    # With a profile cache, fresh profiles are written from the cache and only stale or missing ones are fetched
+    remaining = checkpoint.remaining
+    if cache is not None:
+        remaining = functools.partial(select_stale_users, cache, writer, checkpoint)
+        if leases is None:
+            remaining_user_ids = remaining(remaining_user_ids)
+
+    if leases is None and len(remaining_user_ids) == 0:
+        writer.close()
+        checkpoint.close()
+        if cache is not None:
+            cache.close()
+        logger.info("No new users to fetch. Exiting.")
+        return
+
+    # One worker per active account keeps every logged-in account busy
+    if num_workers is None:
+        num_workers = await get_active_account_count(api, QUEUE)
+    num_workers = max(1, num_workers if leases else min(num_workers, len(remaining_user_ids)))
+    logger.info(f"Fetching user details with {num_workers} concurrent workers.")
 
-    logger.info(f"Finished fetching user details. Files saved to the '{user_infos_folder}' folder.")
+    # Bounded queue so that workers are fed without materializing extra copies of the IDs
+    queue = asyncio.Queue(maxsize=num_workers * 2)
+    progress = {"processed": 0}
+    gate = gate or QueueGate(api, QUEUE)
+    workers = [asyncio.create_task(worker(api, queue, writer, progress, gate, cache)) for _ in range(num_workers)]
+
+    try:
+        if leases is None:
+            for user_id in iter_ids(remaining_user_ids):
+                await queue.put(user_id)
+            await queue.join()
+        else:
+            await process_leases(leases, queue, writer, remaining)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        writer.close()
+        checkpoint.close()
+        if cache is not None:
+            cache.close()
+
+    logger.info(f"Finished fetching user details. Segments saved to the '{user_infos_folder}' folder.")
+
+
+def open_cache(ttl_hours, cache_size=MAX_ENTRIES, eviction="lru"):
+    """Open the profile cache when a TTL is given, otherwise return None."""
+    return ProfileCache(ttl_hours, max_entries=cache_size, eviction=eviction) if ttl_hours is not None else None
+
+
+async def main(batch_no_str, num_workers=None, id_file=None, compression=None, coordinator=None, ttl_hours=None,
+               cache_size=MAX_ENTRIES, eviction="lru", harvest=False):
+    """Main function to fetch user details."""
+    cache = open_cache(ttl_hours, cache_size, eviction)
+    await run_job(API(), batch_no_str, num_workers, id_file=id_file, compression=compression,
+                  coordinator=coordinator, cache=cache, harvest=harvest)
 
 
 if __name__ == "__main__":
-    # Validate and parse batch number
-    if len(sys.argv) != 2:
-        logger.error("Usage: python script.py <batch_no>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Fetch user details for a batch of user IDs.")
+    parser.add_argument("batch_no", help="Batch number of the user_ids_NNN.txt file to process.")
+    parser.add_argument("--id-file", default=None,
+                        help="ID file to process (default: user_ids_NNN.txt).")
+    parser.add_argument("--submit", action="store_true",
+                        help="Queue the job for worker_daemon.py instead of running it now.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent requests (default: number of active accounts).")
+    parser.add_argument("--compress", choices=["zstd"], default=None,
+                        help="Write zstd-compressed segments with seekable frames (requires zstandard).")
+    parser.add_argument("--coordinator", default=None,
+                        help="URL of the lease coordinator to pull ID leases from instead of the batch file.")
+    parser.add_argument("--harvest", action="store_true",
+                        help="First copy the users embedded in collected tweets and user_tweets (harvest_users.py).")
+    parser.add_argument("--ttl-hours", type=float, default=None,
+                        help="Keep fetched profiles in profile_cache.db and only refetch those older than this.")
+    parser.add_argument("--cache-size", type=int, default=MAX_ENTRIES,
+                        help=f"Profiles kept in the cache after a run (default: {MAX_ENTRIES}).")
+    parser.add_argument("--evict", choices=list(EVICTION_POLICIES), default="lru",
+                        help="Profiles evicted first when the cache is full: least recently used (default) "
+                             "or fetched longest ago.")
+    args = parser.parse_args()
 
-    batch_no = sys.argv[1]
+    # Validate and parse batch number
+    batch_no = args.batch_no
     if not batch_no.isdigit():
         logger.error("<batch_no> must be an integer.")
         sys.exit(1)
 
+    if args.workers is not None and args.workers < 1:
+        logger.error("--workers must be a positive integer.")
+        sys.exit(1)
+
+    if args.ttl_hours is not None and args.ttl_hours <= 0:
+        logger.error("--ttl-hours must be positive.")
+        sys.exit(1)
+
+    if args.cache_size < 1:
+        logger.error("--cache-size must be a positive integer.")
+        sys.exit(1)
+
     batch_no = int(batch_no)
     batch_no_str = str(batch_no).zfill(3)
 
+    if args.submit:
+        job_id = submit_job("user_infos", batch_no_str, args.id_file, options={
+            "num_workers": args.workers, "compression": args.compress, "coordinator": args.coordinator,
+            "harvest": args.harvest or None, "ttl_hours": args.ttl_hours, "cache_size": args.cache_size,
+            "eviction": args.evict,
+        })
+        logger.info(f"Submitted user_infos job {job_id} for batch {batch_no_str} to the worker daemon.")
+        sys.exit(0)
+
     try:
-        asyncio.run(main(batch_no_str))  # Pass batch_no_str to the main function
+        asyncio.run(main(batch_no_str, args.workers, args.id_file, args.compress, args.coordinator, args.ttl_hours,
+                         args.cache_size, args.evict, args.harvest))  # Pass batch_no_str to the main function
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
@@ -1,26 +1,36 @@
+import argparse
 import asyncio
+import json
 import os
 import sys
+import numpy as np
 from twscrape import API
 from twscrape.logger import set_log_level, logger
+from twscrape.models import parse_tweets
+from twscrape.utils import find_obj
+from checkpoint import CollectedIndex
+from segment_store import append_manifest, fsync_folder
+from id_batches import iter_ids, load_id_array
+from log_utils import add_log_file
+from job_queue import submit_job
+from lease_client import LeaseClient
+from pool_utils import QueueGate, get_queue_capacity
 
 # Set log level globally
 set_log_level("DEBUG")
 
-def load_user_data(batch_no_str):
+QUEUE = "UserTweetsAndReplies"
+TWEET_LIMIT = 3200
+POLL_INTERVAL = 60  # Seconds between pool capacity checks
+
+def load_user_data(batch_no_str, id_file=None, leased=False):
     """Load user data, check collected users, and prepare file paths."""
-    logger.add(f"logs/user_tweets_{batch_no_str}.log", level="DEBUG")
+    add_log_file(f"logs/user_tweets_{batch_no_str}.log")
 
     # Create "user_tweets" folder if it doesn't exist
     user_tweets_folder = "user_tweets"
     os.makedirs(user_tweets_folder, exist_ok=True)
 
-    # Load user IDs
-    with open(f"user_ids_{batch_no_str}.txt", "r") as f:
-        user_ids = f.read().strip().split("\n")
-
-    user_ids = [int(user_id) for user_id in user_ids]
-
     # Check already collected user IDs
     def get_collected_user_ids(folder):
         """Retrieve a set of user IDs already collected."""
@@ -33,79 +43,286 @@ def load_user_data(batch_no_str):
                     logger.warning(f"Invalid file name in user tweets folder: {filename}")
         return collected_ids
 
-    collected_user_ids = get_collected_user_ids(user_tweets_folder)
+    # The folder is only listed once to build the checkpoint, later runs read the checkpoint
+    checkpoint = CollectedIndex(user_tweets_folder, rebuild=get_collected_user_ids)
 
-    # Filter out already collected user IDs
-    remaining_user_ids = [user_id for user_id in user_ids if user_id not in collected_user_ids]
+    if leased:
+        # IDs are leased from the coordinator instead of read from the batch file
+        logger.info(f"User timelines collected so far: {len(checkpoint)}")
+        return user_tweets_folder, None, checkpoint
 
-    if not remaining_user_ids:
-        logger.info("No new users to fetch. Exiting.")
-        sys.exit(0)
+    # Load user IDs as an int64 array (cached as a memory-mapped .npy sidecar)
+    user_ids = load_id_array(id_file or f"user_ids_{batch_no_str}.txt")
+
+    # Filter out already collected user IDs
+    remaining_user_ids = checkpoint.remaining(user_ids)
 
     logger.info(f"Total user IDs loaded: {len(user_ids)}")
     logger.info(f"Remaining user IDs to fetch: {len(remaining_user_ids)}")
 
-    return user_tweets_folder, remaining_user_ids
+    return user_tweets_folder, remaining_user_ids, checkpoint
 
-async def main(batch_no_str):
-    """Main function to fetch user tweets."""
-    user_tweets_folder, remaining_user_ids = load_user_data(batch_no_str)
-    api = API()
+def load_timeline_state(state_path):
+    """Load the saved pagination state of a partially fetched timeline."""
+    if not os.path.exists(state_path):
+        return {"cursor": None, "offset": 0, "count": 0}
+    with open(state_path, "r") as f:
+        return json.load(f)
 
-    # **Check if accounts are available before fetching tweets**
-    test_account = await api.pool.get_for_queue_or_wait("UserTweetsAndReplies")
-    if test_account is None:
-        logger.error("No active accounts available. Exiting.")
-        sys.exit(1)  # Stop the script immediately
+def save_timeline_state(state_path, state):
+    """Atomically save the pagination state of a timeline."""
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+
+async def fetch_user_timeline(api, user_tweets_folder, user_id, limit=TWEET_LIMIT, progress=None):
+    """Stream a user's tweets to a temp file page by page and commit it with an atomic rename."""
+    file_path = os.path.join(user_tweets_folder, f"{user_id}.jsonl")
+    part_path = f"{file_path}.part"
+    state_path = os.path.join(user_tweets_folder, f"{user_id}.cursor")
+
+    if os.path.exists(file_path):
+        # Renamed before a crash removed its state: the timeline is complete
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        append_manifest(user_tweets_folder, [f"{user_id}.jsonl"])
+        with open(file_path, "rb") as f:
+            return sum(1 for _ in f)
+
+    # Resume from the last persisted page, dropping anything written after it
+    state = load_timeline_state(state_path)
+    part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if state["offset"] > part_size:
+        logger.warning(f"Saved state of user {user_id} does not match its partial file. Restarting the timeline.")
+        state = {"cursor": None, "offset": 0, "count": 0}
+    elif state["cursor"]:
+        logger.info(f"Resuming timeline of user {user_id} after {state['count']} tweets.")
+
+    with open(part_path, "ab") as f:
+        f.truncate(state["offset"])
+        f.seek(state["offset"])
+
+        remaining = limit - state["count"]
+        kv = {"cursor": state["cursor"]} if state["cursor"] else None
+        if remaining > 0 and not state.get("complete"):
+            async for rep in api.user_tweets_and_replies_raw(user_id, limit=remaining, kv=kv):
+                page = rep.json()
+                for tweet in parse_tweets(page, remaining):
+                    f.write(tweet.json().encode("utf-8") + b"\n")
+                    state["count"] += 1
+
+                # Persist the page before its cursor so a restart never skips tweets
+                f.flush()
+                os.fsync(f.fileno())
+                cursor = find_obj(page, lambda x: x.get("cursorType") == "Bottom")
+                state["cursor"] = cursor.get("value") if cursor else None
+                state["offset"] = f.tell()
+                save_timeline_state(state_path, state)
+                if progress is not None:
+                    progress["pages"] += 1
+
+    # Mark the timeline complete first, so a crash before the rename never refetches it from the first page
+    state["complete"] = True
+    save_timeline_state(state_path, state)
+    os.replace(part_path, file_path)
+    fsync_folder(user_tweets_folder)
+    os.remove(state_path)
+    fsync_folder(user_tweets_folder)
+    append_manifest(user_tweets_folder, [f"{user_id}.jsonl"])
+
+    return state["count"]
+
+async def process_user(api, user_tweets_folder, checkpoint, user_id, progress):
+    """Fetch one user's timeline and record the user in the checkpoint."""
+    try:
+        # Fetch tweets, streaming them to a temp file that is renamed once the user is done
+        tweet_count = await fetch_user_timeline(api, user_tweets_folder, user_id, progress=progress)
+
+        if tweet_count == 0:
+            # If request was valid but returned no tweets, an empty JSONL file is left behind
+            logger.info(f"User {user_id} has no tweets. Created an empty JSONL file.")
+
+        checkpoint.add_many([user_id])
+
+    except Exception as e:
+        logger.error(f"Error fetching tweets for user {user_id}: {e}")
+
+async def worker(api, user_ids, user_tweets_folder, checkpoint, progress, stop_event, gate):
+    """Paginate timelines one user at a time until the IDs run out or the scheduler stops."""
+    while not stop_event.is_set():
+        user_id = next(user_ids, None)
+        if user_id is None:
+            break
+
+        async with gate:
+            await process_user(api, user_tweets_folder, checkpoint, user_id, progress)
+        progress["users"] += 1
 
-    # Fetch user tweets and save tweets to JSONL file
-    for idx, user_id in enumerate(remaining_user_ids, start=1):
         # Log progress every 1,000 users
-        if idx % 1_000 == 0:
-            logger.info(f"{idx} users processed so far...")
+        if progress["users"] % 1_000 == 0:
+            logger.info(f"{progress['users']} users processed so far...")
 
+async def watch_capacity(api, progress, stop_event, poll_interval=POLL_INTERVAL):
+    """Stop the scheduler once every account is rate-limited and no page was fetched for a whole interval."""
+    last_pages = progress["pages"]
+    while not stop_event.is_set():
         try:
-            file_path = os.path.join(user_tweets_folder, f"{user_id}.jsonl")
-            
-            # Check for account exhaustion before making API calls
-            current_account = await api.pool.get_for_queue_or_wait("UserTweetsAndReplies")
-            if current_account is None:
-                logger.error("All accounts are exhausted. Stopping further requests.")
-                break  # Stop processing further user IDs
-
-            # Fetch tweets
-            tweets = []
-            async for tweet in api.user_tweets_and_replies(user_id, limit=3200):
-                tweets.append(tweet.json())
-
-            if tweets:
-                with open(file_path, "w") as f:
-                    f.write("\n".join(tweets))
-            else:
-                # If request was valid but returned no tweets, create empty JSONL file
-                open(file_path, "w").close()
-                logger.info(f"User {user_id} has no tweets. Created an empty JSONL file.")
-
-        except Exception as e:
-            logger.error(f"Error fetching tweets for user {user_id}: {e}")
+            await asyncio.wait_for(stop_event.wait(), timeout=poll_interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        capacity = await get_queue_capacity(api, QUEUE)
+        if capacity["active"] == 0:
+            logger.error("No active accounts left. Stopping further requests.")
+            stop_event.set()
+        elif capacity["available"] == 0 and progress["pages"] == last_pages:
+            logger.error(f"All accounts are rate-limited until {capacity['next_reset']}. Stopping further requests.")
+            stop_event.set()
+        last_pages = progress["pages"]
+
+async def schedule_users(api, remaining_user_ids, num_workers, user_tweets_folder, checkpoint, progress, stop_event,
+                         gate):
+    """Run the workers over a set of user IDs. Returns False if the scheduler was stopped before they were done."""
+    # Two workers on the same user would append to (and truncate) the same .part file, so repeated IDs are dropped
+    _, first_positions = np.unique(remaining_user_ids, return_index=True)
+    if len(first_positions) < len(remaining_user_ids):
+        logger.warning(f"Skipping {len(remaining_user_ids) - len(first_positions)} repeated user IDs.")
+        remaining_user_ids = remaining_user_ids[np.sort(first_positions)]
+
+    # Workers share one ID iterator, so every user is handed out exactly once
+    user_ids = iter_ids(remaining_user_ids)
+    workers = asyncio.gather(*[
+        worker(api, user_ids, user_tweets_folder, checkpoint, progress, stop_event, gate) for _ in range(num_workers)
+    ])
+
+    # Wait until all users are done or the monitor stops the scheduler
+    stopped = asyncio.create_task(stop_event.wait())
+    await asyncio.wait([workers, stopped], return_when=asyncio.FIRST_COMPLETED)
+    if stop_event.is_set():
+        # Timelines in progress keep their saved cursor and resume on the next run
+        workers.cancel()
+    else:
+        stopped.cancel()
+    await asyncio.gather(workers, stopped, return_exceptions=True)
+    return not stop_event.is_set()
+
+async def schedule_leases(leases, api, num_workers, user_tweets_folder, checkpoint, progress, stop_event, gate):
+    """Process leased user IDs lease by lease. Returns False if the scheduler was stopped first."""
+    while not stop_event.is_set():
+        lease_id, ids = await leases.next_lease()
+        if lease_id is None:
+            return True
+
+        # A lease that is not finished is left to expire, so the coordinator hands it out again
+        remaining_user_ids = checkpoint.remaining(ids)
+        users_before = progress["users"] - (len(ids) - len(remaining_user_ids))
+        async with leases.keep_alive(lease_id, lambda: progress["users"] - users_before):
+            finished = await schedule_users(api, remaining_user_ids, num_workers, user_tweets_folder, checkpoint,
+                                            progress, stop_event, gate)
+        if not finished:
+            return False
+        await leases.complete_lease(lease_id)
+    return False
+
+async def run_job(api, batch_no_str, num_workers=None, gate=None, stop_when_exhausted=True, id_file=None,
+                  coordinator=None):
+    """Fetch user tweets for a batch with one concurrent timeline per active account."""
+    # With a coordinator, IDs are pulled lease by lease instead of read from the batch file
+    leases = LeaseClient(coordinator, "user_tweets") if coordinator else None
+    user_tweets_folder, remaining_user_ids, checkpoint = load_user_data(batch_no_str, id_file,
+                                                                       leased=leases is not None)
+
+    if leases is None and len(remaining_user_ids) == 0:
+        checkpoint.close()
+        logger.info("No new users to fetch. Exiting.")
+        return
+
+    # Check account capacity once from the pool state instead of probing before every user
+    capacity = await get_queue_capacity(api, QUEUE)
+    if capacity["active"] == 0:
+        checkpoint.close()
+        logger.error("No active accounts available. Exiting.")
+        return
+
+    if capacity["available"] == 0 and stop_when_exhausted:
+        logger.error(f"All accounts are rate-limited until {capacity['next_reset']}. Exiting.")
+        checkpoint.close()
+        return
+
+    if num_workers is None:
+        num_workers = capacity["active"]  # Rate-limited accounts free up long before the run ends
+    num_workers = max(1, num_workers if leases else min(num_workers, len(remaining_user_ids)))
+    logger.info(f"Fetching user timelines with {num_workers} concurrent workers.")
+
+    progress = {"users": 0, "pages": 0}
+    stop_event = asyncio.Event()
+    gate = gate or QueueGate(api, QUEUE)
+
+    # Without the monitor (combined runner), rate-limited workers wait in the gate for the next reset
+    if stop_when_exhausted:
+        monitor = asyncio.create_task(watch_capacity(api, progress, stop_event))
+    else:
+        monitor = asyncio.create_task(stop_event.wait())
+
+    try:
+        if leases is None:
+            finished = await schedule_users(api, remaining_user_ids, num_workers, user_tweets_folder, checkpoint,
+                                            progress, stop_event, gate)
+        else:
+            finished = await schedule_leases(leases, api, num_workers, user_tweets_folder, checkpoint, progress,
+                                             stop_event, gate)
+        if not finished:
+            logger.warning("Stopped before all users were processed. Run the script again to resume.")
+        stop_event.set()
+        await asyncio.gather(monitor, return_exceptions=True)
+    finally:
+        checkpoint.close()
 
     logger.info(f"Finished fetching user tweets. Files saved to the '{user_tweets_folder}' folder.")
 
+async def main(batch_no_str, num_workers=None, id_file=None, coordinator=None):
+    """Main function to fetch user tweets."""
+    await run_job(API(), batch_no_str, num_workers, id_file=id_file, coordinator=coordinator)
+
 if __name__ == "__main__":
-    # Validate and parse batch number
-    if len(sys.argv) != 2:
-        logger.error("Usage: python script.py <batch_no>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Fetch tweets and replies for a batch of user IDs.")
+    parser.add_argument("batch_no", help="Batch number of the user_ids_NNN.txt file to process.")
+    parser.add_argument("--id-file", default=None,
+                        help="ID file to process (default: user_ids_NNN.txt).")
+    parser.add_argument("--submit", action="store_true",
+                        help="Queue the job for worker_daemon.py instead of running it now.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent timelines (default: number of active accounts).")
+    parser.add_argument("--coordinator", default=None,
+                        help="URL of the lease coordinator to pull ID leases from instead of the batch file.")
+    args = parser.parse_args()
 
-    batch_no = sys.argv[1]
+    # Validate and parse batch number
+    batch_no = args.batch_no
     if not batch_no.isdigit():
         logger.error("<batch_no> must be an integer.")
         sys.exit(1)
 
+    if args.workers is not None and args.workers < 1:
+        logger.error("--workers must be a positive integer.")
+        sys.exit(1)
+
     batch_no = int(batch_no)
     batch_no_str = str(batch_no).zfill(3)
 
+    if args.submit:
+        job_id = submit_job("user_tweets", batch_no_str, args.id_file, options={
+            "num_workers": args.workers, "coordinator": args.coordinator,
+        })
+        logger.info(f"Submitted user_tweets job {job_id} for batch {batch_no_str} to the worker daemon.")
+        sys.exit(0)
+
     try:
-        asyncio.run(main(batch_no_str))  # Pass batch_no_str to the main function
+        asyncio.run(main(batch_no_str, args.workers, args.id_file, args.coordinator))  # Pass batch_no_str to the main function
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+import numpy as np
+from twscrape.logger import set_log_level, logger
+from segment_store import INDEX_SUFFIX, SegmentWriter, get_collected_ids, is_segment, iter_segment
+from checkpoint import CollectedIndex
+from log_utils import add_log_file
+
+# Set log level globally
+set_log_level("DEBUG")
+
+SOURCE_FOLDERS = ("tweets", "user_tweets")  # Outputs of get_tweet_info.py and get_user_tweets.py
+USER_INFOS_FOLDER = "user_infos"
+
+# Source files already harvested, kept with the other checkpoint files of the user_infos folder
+HARVESTED_FILE = ".collected_harvested"
+
+
+def list_sources(folder):
+    """List the finished tweet files of a folder, oldest first."""
+    paths = []
+    for name in os.listdir(folder):
+        # Sealed segments (tweets), per-user timelines (user_tweets) and legacy per-ID JSON files
+        if is_segment(name) or name.endswith(".json"):
+            paths.append(os.path.join(folder, name))
+    return sorted(paths, key=os.path.getmtime)
+
+
+def iter_tweet_records(path):
+    """Yield the tweet JSON strings of one source file."""
+    if os.path.exists(path + INDEX_SUFFIX):
+        for _, record in iter_segment(path):
+            yield record
+    elif path.endswith(".json"):
+        with open(path, "r") as f:
+            yield f.read()
+    else:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def embedded_users(tweet):
+    """Return the user objects of a tweet and of its retweeted and quoted tweets."""
+    users = []
+    for item in (tweet, tweet.get("retweetedTweet"), tweet.get("quotedTweet")):
+        if item and item.get("user"):
+            users.append(item["user"])
+    return users
+
+
+def load_harvested(user_infos_folder):
+    path = os.path.join(user_infos_folder, HARVESTED_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def save_harvested(user_infos_folder, sources):
+    """Durably record the source files whose users have been harvested."""
+    with open(os.path.join(user_infos_folder, HARVESTED_FILE), "a") as f:
+        f.writelines(f"{path}\n" for path in sources)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def find_newest_copies(sources):
+    """Map each user ID to the position (source, record, slot) of its most recently fetched copy."""
+    newest = {}
+    invalid = 0
+    for source_no, path in enumerate(sources):
+        for record_no, record in enumerate(iter_tweet_records(path)):
+            try:
+                users = embedded_users(json.loads(record))
+            except (ValueError, AttributeError):
+                invalid += 1
+                continue
+            # Sources are read oldest first, so later copies replace earlier ones
+            for slot, user in enumerate(users):
+                newest[int(user["id"])] = (source_no, record_no, slot)
+    if invalid:
+        logger.warning(f"Skipped {invalid} unreadable tweet records.")
+    return newest
+
+
+def harvest_users(source_folders=SOURCE_FOLDERS, user_infos_folder=USER_INFOS_FOLDER, compression=None, cache=None,
+                  checkpoint=None):
+    """Write the newest embedded copy of every user not in user_infos yet to the user_infos store."""
+    os.makedirs(user_infos_folder, exist_ok=True)
+    own_checkpoint = checkpoint is None  # get_user_info.py passes the checkpoint it already holds
+    if own_checkpoint:
+        checkpoint = CollectedIndex(user_infos_folder, rebuild=get_collected_ids)
+    harvested = load_harvested(user_infos_folder)
+
+    # Oldest first across all folders, so the newest copy of a user wins whichever script fetched it
+    sources = sorted((path for folder in source_folders if os.path.isdir(folder)
+                      for path in list_sources(folder) if path not in harvested), key=os.path.getmtime)
+    if not sources:
+        if own_checkpoint:
+            checkpoint.close()
+        logger.info("No new tweet files to harvest users from.")
+        return 0
+    logger.info(f"Harvesting users from {len(sources)} new tweet files...")
+
+    # First pass: only the position of each user's newest copy is kept in memory
+    newest = find_newest_copies(sources)
+    user_ids = np.fromiter(newest.keys(), dtype=np.int64, count=len(newest))
+    new_user_ids = set(checkpoint.remaining(user_ids).tolist())
+    logger.info(f"Found {len(newest)} users, {len(new_user_ids)} of them not in '{user_infos_folder}' yet.")
+
+    picks = defaultdict(lambda: defaultdict(list))  # source_no -> record_no -> [(slot, user_id)]
+    for user_id, (source_no, record_no, slot) in newest.items():
+        if user_id in new_user_ids or cache is not None:
+            picks[source_no][record_no].append((slot, user_id))
+    del newest
+
+    # Second pass: re-read only the sources that hold a newest copy
+    on_seal = checkpoint.record_segment
+    if cache is not None:
+        on_seal = cache.skip_seeding(on_seal, user_infos_folder)
+    writer = SegmentWriter(user_infos_folder, "user_infos", on_seal=on_seal, compression=compression)
+    written = 0
+    try:
+        for source_no in sorted(picks):
+            records = picks[source_no]
+            fetched_at = os.path.getmtime(sources[source_no])  # The copy is as old as the file it was fetched into
+            for record_no, record in enumerate(iter_tweet_records(sources[source_no])):
+                if record_no not in records:
+                    continue
+                users = embedded_users(json.loads(record))
+                for slot, user_id in records[record_no]:
+                    profile = json.dumps(users[slot])
+                    if user_id in new_user_ids:
+                        writer.write(user_id, profile)
+                        written += 1
+                    if cache is not None:
+                        cache.put(user_id, profile, fetched_at=fetched_at)
+    finally:
+        writer.close()
+
+    # Sources are only marked once their users are sealed; a rerun skips users already written
+    save_harvested(user_infos_folder, sources)
+    if own_checkpoint:
+        checkpoint.close()
+    logger.info(f"Harvested {written} users into '{user_infos_folder}'.")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the user objects embedded in collected tweets into user_infos.")
+    parser.add_argument("--sources", nargs="+", default=list(SOURCE_FOLDERS),
+                        help="Folders of collected tweets to harvest (default: tweets user_tweets).")
+    parser.add_argument("--compress", choices=["zstd"], default=None,
+                        help="Write zstd-compressed segments with seekable frames (requires zstandard).")
+    args = parser.parse_args()
+
+    add_log_file("logs/harvest_users.log")
+
+    try:
+        harvest_users(args.sources, compression=args.compress)
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        sys.exit(1)
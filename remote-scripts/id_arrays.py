@@ -0,0 +1,41 @@
+import numpy as np
+
+# Shared by the remote scripts and the local scripts (which add this folder to sys.path), so the
+# ID parsing and lookup rules are the same everywhere. Only depends on numpy.
+READ_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def iter_id_blocks(path):
+    """Yield the IDs of a newline-separated ID file as int64 arrays, one block at a time."""
+    remainder = b""
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+
+            # Only parse complete lines, carry the rest over to the next block
+            block = remainder + block
+            cut = block.rfind(b"\n") + 1
+            tokens = block[:cut].split()
+            remainder = block[cut:]
+            if tokens:
+                yield np.array(tokens).astype(np.int64)
+
+    if remainder.strip():
+        yield np.array(remainder.split()).astype(np.int64)
+
+
+def parse_id_file(path):
+    """Parse a newline-separated ID file into an int64 array, one block at a time."""
+    chunks = list(iter_id_blocks(path))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+
+def sorted_contains(sorted_ids, ids):
+    """Vectorized membership test of ids in a sorted int64 array."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = len(sorted_ids) - 1
+    return sorted_ids[positions] == ids
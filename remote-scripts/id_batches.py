@@ -0,0 +1,52 @@
+import os
+import numpy as np
+from twscrape.logger import logger
+from id_arrays import parse_id_file, sorted_contains  # Re-exported for the other remote scripts
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def source_signature(path):
+    """Size and mtime of an ID file. Any change (even to an older mtime, e.g. extracted from a tar) is detected."""
+    stat = os.stat(path)
+    return f"{stat.st_size} {stat.st_mtime_ns}"
+
+
+def load_id_array(path, use_cache=True):
+    """Load an ID file as an int64 array, reusing a memory-mapped .npy sidecar when it is up to date."""
+    cache_path = os.path.splitext(path)[0] + ".npy"
+    signature_path = cache_path + ".source"  # Signature of the ID file the cache was built from
+    signature = source_signature(path)
+
+    if use_cache and os.path.exists(cache_path) and os.path.exists(signature_path):
+        with open(signature_path, "r") as f:
+            if f.read().strip() == signature:
+                logger.info(f"Loading IDs from cache: {cache_path}")
+                return np.load(cache_path, mmap_mode="r")
+
+    ids = parse_id_file(path)
+
+    if use_cache:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, ids)
+        os.replace(tmp_path, cache_path)
+        # Written after the cache, so a crash in between only causes one more parse
+        with open(f"{signature_path}.tmp", "w") as f:
+            f.write(signature)
+        os.replace(f"{signature_path}.tmp", signature_path)
+        logger.info(f"Cached {len(ids)} IDs to {cache_path}")
+
+    return ids
+
+
+def iter_id_chunks(ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the IDs as lists of Python ints, chunk_size at a time."""
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size].tolist()
+
+
+def iter_ids(ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the IDs one by one as Python ints, converting chunk_size of them at a time."""
+    for chunk in iter_id_chunks(ids, chunk_size):
+        yield from chunk
@@ -0,0 +1,113 @@
+import fcntl
+import json
+import sqlite3
+from datetime import datetime
+
+DB_PATH = "jobs.db"
+DAEMON_LOCK_PATH = "worker_daemon.lock"  # Held by the running worker daemon
+JOB_TYPES = ("tweets", "user_infos", "user_tweets")
+
+
+def connect(db_path=DB_PATH):
+    """Open the job queue database, creating the jobs table if needed."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            batch_no TEXT NOT NULL,
+            id_file TEXT,
+            options TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            submitted_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            error TEXT
+        )
+    """)
+    # Queues created before jobs kept their command-line options
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "options" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+    conn.commit()
+    return conn
+
+
+def lock_daemon(path=DAEMON_LOCK_PATH):
+    """Take the single-daemon lock without waiting. Returns the lock file, or None if another daemon holds it."""
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def submit_job(job_type, batch_no_str, id_file=None, options=None, db_path=DB_PATH):
+    """Add a job to the queue and return its ID.
+
+    options are keyword arguments for the job's run_job (e.g. num_workers, compression); unset ones are dropped.
+    """
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {job_type}")
+    options = {key: value for key, value in (options or {}).items() if value is not None}
+
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute(
+            "INSERT INTO jobs (job_type, batch_no, id_file, options, submitted_at) VALUES (?, ?, ?, ?, ?)",
+            (job_type, batch_no_str, id_file, json.dumps(options) if options else None, now())
+        )
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def job_options(job):
+    """Return the run_job keyword arguments a job was submitted with."""
+    return json.loads(job["options"]) if job["options"] else {}
+
+
+def claim_next_job(conn, busy_job_types):
+    """Mark the oldest queued job of a job type that is not running yet as running and return it."""
+    placeholders = ",".join("?" for _ in busy_job_types)
+    query = "SELECT * FROM jobs WHERE status = 'queued'"
+    if busy_job_types:
+        query += f" AND job_type NOT IN ({placeholders})"
+    job = conn.execute(query + " ORDER BY id LIMIT 1", tuple(busy_job_types)).fetchone()
+    if job is None:
+        return None
+
+    conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now(), job["id"]))
+    conn.commit()
+    return job
+
+
+def finish_job(conn, job_id, error=None):
+    """Record the outcome of a job."""
+    status = "failed" if error else "done"
+    conn.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+        (status, now(), error, job_id)
+    )
+    conn.commit()
+
+
+def requeue_interrupted_jobs(conn):
+    """Put jobs that were running when the daemon stopped back in the queue."""
+    cursor = conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+    conn.commit()
+    return cursor.rowcount
+
+
+def list_jobs(conn, limit=20):
+    """Return the most recent jobs, newest first."""
+    return conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import socket
+from contextlib import asynccontextmanager
+import urllib.error
+import urllib.request
+import numpy as np
+from twscrape.logger import logger
+from id_batches import iter_ids
+
+RETRY_INTERVAL = 30  # Seconds to wait while other workers still hold leases that may come back
+REQUEST_TIMEOUT = 30
+TOKEN_FILE = "lease_token"  # Coordinator token, uploaded by scripts/run_remote_scripts.py --coordinator
+RENEWALS_PER_LEASE = 4  # A lease is renewed this many times per lease duration, so a missed renewal is harmless
+
+
+def read_token(path=TOKEN_FILE):
+    """Read the coordinator token, or None if it was not uploaded."""
+    if not os.path.exists(path):
+        logger.warning(f"No coordinator token in '{path}'. The coordinator will reject the requests.")
+        return None
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+class LeaseClient:
+    """Pull ID leases for a job type from the lease coordinator (scripts/lease_coordinator.py)."""
+
+    def __init__(self, url, job_type, worker=None, token=None):
+        self.url = url.rstrip("/")
+        self.token = token or read_token()
+        self.job_type = job_type
+        self.worker = worker or socket.gethostname()  # Server name, e.g. tw-001
+        self.lease_seconds = None  # Lease duration of the job type, as reported by the coordinator
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.token}"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def lease(self):
+        """Request the next lease. Returns (lease_id, ids, outstanding) with lease_id None when nothing is pending."""
+        response = self._post("/lease", {"job_type": self.job_type, "worker": self.worker})
+        self.lease_seconds = response.get("lease_seconds", self.lease_seconds)
+        ids = np.array(response["ids"], dtype=np.int64)
+        return response["lease_id"], ids, response.get("outstanding", 0)
+
+    def renew(self, lease_id, done=0):
+        """Extend a lease that is still being processed. Returns False if the coordinator no longer holds it for us."""
+        response = self._post("/renew", {"lease_id": lease_id, "worker": self.worker, "done": done})
+        return response.get("ok", False)
+
+    def complete(self, lease_id):
+        """Report a lease as done."""
+        self._post("/complete", {"lease_id": lease_id, "worker": self.worker})
+
+    async def next_lease(self, retry_interval=RETRY_INTERVAL):
+        """Wait for the next lease. Returns (lease_id, ids), or (None, None) once all work is done."""
+        while True:
+            try:
+                lease_id, ids, outstanding = await asyncio.to_thread(self.lease)
+            except urllib.error.HTTPError:
+                raise  # The coordinator rejected the request (e.g. job type not loaded)
+            except OSError as e:
+                logger.warning(f"Lease coordinator not reachable: {e}. Retrying in {retry_interval}s...")
+                await asyncio.sleep(retry_interval)
+                continue
+
+            if lease_id is not None:
+                logger.info(f"Leased {len(ids)} {self.job_type} IDs (lease {lease_id}).")
+                return lease_id, ids
+            if not outstanding:
+                logger.info(f"No {self.job_type} IDs left at the coordinator.")
+                return None, None
+            # Leases held by other workers may expire and be handed out again
+            logger.info(f"{outstanding} {self.job_type} leases are still held by other workers. "
+                        f"Checking again in {retry_interval}s...")
+            await asyncio.sleep(retry_interval)
+
+    async def _renew_periodically(self, lease_id, done):
+        while True:
+            await asyncio.sleep((self.lease_seconds or RETRY_INTERVAL * RENEWALS_PER_LEASE) / RENEWALS_PER_LEASE)
+            try:
+                renewed = await asyncio.to_thread(self.renew, lease_id, done())
+            except OSError as e:
+                logger.warning(f"Could not renew lease {lease_id}: {e}")
+                continue
+            if not renewed:
+                # The work is still finished and reported; the coordinator counts it as a late duplicate
+                logger.warning(f"Lease {lease_id} expired and was handed out again before it could be renewed.")
+                return
+
+    @asynccontextmanager
+    async def keep_alive(self, lease_id, done=lambda: 0):
+        """Renew a lease while the block processes it. done() returns the number of its IDs finished so far."""
+        renewal = asyncio.create_task(self._renew_periodically(lease_id, done))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            await asyncio.gather(renewal, return_exceptions=True)
+
+    async def complete_lease(self, lease_id, retries=3):
+        """Report a lease as done; if that keeps failing the lease expires and is handed out again."""
+        for attempt in range(1, retries + 1):
+            try:
+                await asyncio.to_thread(self.complete, lease_id)
+                return
+            except OSError as e:
+                logger.warning(f"Could not complete lease {lease_id} (attempt {attempt}/{retries}): {e}")
+                await asyncio.sleep(REQUEST_TIMEOUT)
+        logger.error(f"Giving up on completing lease {lease_id}. It will be reclaimed by the coordinator.")
+
+
+async def process_leases(client, queue, writer, remaining):
+    """Feed leased IDs to the worker queue lease by lease until the coordinator runs out of work.
+
+    remaining(ids) returns the leased IDs that still have to be fetched, e.g. CollectedIndex.remaining.
+    """
+    while True:
+        lease_id, ids = await client.next_lease()
+        if lease_id is None:
+            return
+
+        # IDs collected by an earlier (expired) lease of this server are skipped
+        todo = remaining(ids)
+        queued = 0
+        async with client.keep_alive(lease_id, lambda: len(ids) - len(todo) + queued - queue.qsize()):
+            for record_id in iter_ids(todo):
+                await queue.put(record_id)
+                queued += 1
+            await queue.join()
+
+        # Results must be durable before the lease is reported done
+        writer.flush()
+        await client.complete_lease(lease_id)
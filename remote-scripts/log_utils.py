@@ -0,0 +1,9 @@
+from twscrape.logger import logger
+
+LOG_FILES = {}
+
+
+def add_log_file(path):
+    """Save logs to a file, adding each file only once per process (the daemon runs many jobs)."""
+    if path not in LOG_FILES:
+        LOG_FILES[path] = logger.add(path, level="DEBUG")
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 from twscrape import API
 from twscrape.logger import set_log_level, logger
@@ -7,6 +8,10 @@ import sys
 # Set log level globally
 set_log_level("DEBUG")
 
+LOGIN_CONCURRENCY = 10  # Accounts logging in at the same time
+LOGIN_RETRIES = 3  # Attempts per account
+RETRY_BACKOFF = 30  # Seconds before the first retry, doubled after every failed attempt
+
 
 def load_twitter_accounts(batch_no_str):
     """Load Twitter accounts from the JSON file for the given batch."""
@@ -24,7 +29,49 @@ def load_twitter_accounts(batch_no_str):
         sys.exit(1)
 
 
-async def main(batch_no_str):
+def has_session(account):
+    """Check whether an account already has a usable session stored in accounts.db."""
+    return account.active and "auth_token" in account.cookies and "ct0" in account.cookies
+
+
+async def sync_account(api, account_data):
+    """Add an account to the pool, re-adding it only when its credentials have changed."""
+    username = account_data["username"]
+    password = account_data["password"]
+    email = account_data["email"]
+
+    account = await api.pool.get_account(username)
+    if account is not None and (account.password != password or account.email != email):
+        # Stale credentials: drop the old account (and its session) and add it again
+        await api.pool.delete_accounts(username)
+        logger.info(f"Credentials changed for account: {username}")
+        account = None
+
+    if account is None:
+        await api.pool.add_account(username, password, email, password)
+        logger.info(f"Added account: {username}")
+        account = await api.pool.get_account(username)
+
+    return account
+
+
+async def login_account(api, account, semaphore, retries=LOGIN_RETRIES):
+    """Log in one account, retrying with exponential backoff. Returns True on success."""
+    for attempt in range(1, retries + 1):
+        async with semaphore:
+            if await api.pool.login(account):
+                return True
+
+        if attempt < retries:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            logger.warning(f"Login attempt {attempt}/{retries} failed for {account.username}. Retrying in {delay}s...")
+            await asyncio.sleep(delay)
+
+    logger.error(f"Giving up on {account.username} after {retries} login attempts.")
+    return False
+
+
+async def main(batch_no_str, concurrency=LOGIN_CONCURRENCY):
     """Main function to handle login process."""
     twitter_accounts = load_twitter_accounts(batch_no_str)
     total_accounts = len(twitter_accounts)
@@ -32,26 +79,26 @@ async def main(batch_no_str):
     api = API()
     logger.info(f"Starting login process for batch {batch_no_str} with {total_accounts} accounts.")
 
-    # Add accounts to the pool
-    for account in twitter_accounts:
-        username = account["username"]
-        password = account["password"]
-        email = account["email"]
-        await api.pool.add_account(username, password, email, password)
-        logger.info(f"Added account: {username}")
+    # Add new accounts and update changed ones; accounts with a valid session are kept as they are
+    accounts = [await sync_account(api, account_data) for account_data in twitter_accounts]
+    to_login = [account for account in accounts if not has_session(account)]
+    logger.info(f"{total_accounts - len(to_login)} accounts already have a session. "
+                f"Logging in {len(to_login)} accounts with up to {concurrency} at a time...")
 
-    # Log in to all accounts
-    logger.info(f"Attempting to log in all accounts for batch {batch_no_str}...")
-    await api.pool.login_all()
+    # Log in the remaining accounts concurrently
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(*[login_account(api, account, semaphore) for account in to_login])
 
     # Process and log login results
+    usernames = {account_data["username"] for account_data in twitter_accounts}
     accounts_info = await api.pool.accounts_info()
-    logged_in_accounts = [acc["username"] for acc in accounts_info if acc["logged_in"]]
+    logged_in_accounts = [acc["username"] for acc in accounts_info if acc["logged_in"] and acc["username"] in usernames]
     success_count = len(logged_in_accounts)
     failed_count = total_accounts - success_count
 
     logger.success(f"Login results for batch {batch_no_str}:")
     logger.success(f"  - Total accounts: {total_accounts}")
+    logger.success(f"  - Reused sessions: {total_accounts - len(to_login)}")
     logger.success(f"  - Successfully logged in: {success_count}")
     logger.error(f"  - Failed logins: {failed_count}")
 
@@ -63,20 +110,26 @@ async def main(batch_no_str):
 
 
 if __name__ == "__main__":
-    # Validate and parse batch number
-    if len(sys.argv) != 2:
-        logger.error("Usage: python login.py <batch_no>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Add and log in the Twitter accounts of a batch.")
+    parser.add_argument("batch_no", help="Batch number of the twitter_accounts_NNN.json file to use.")
+    parser.add_argument("--concurrency", type=int, default=LOGIN_CONCURRENCY,
+                        help=f"Number of accounts logging in at the same time (default: {LOGIN_CONCURRENCY}).")
+    args = parser.parse_args()
 
-    batch_no = sys.argv[1]
+    # Validate and parse batch number
+    batch_no = args.batch_no
     if not batch_no.isdigit():
         logger.error("<batch_no> must be an integer.")
         sys.exit(1)
 
+    if args.concurrency < 1:
+        logger.error("--concurrency must be a positive integer.")
+        sys.exit(1)
+
     batch_no = int(batch_no)
     batch_no_str = str(batch_no).zfill(3)
 
     try:
-        asyncio.run(main(batch_no_str))  # Pass batch_no_str to the main function
+        asyncio.run(main(batch_no_str, args.concurrency))  # Pass batch_no_str to the main function
     except Exception as e:
         logger.critical(f"Unexpected error: {e}")
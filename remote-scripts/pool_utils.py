@@ -0,0 +1,70 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from twscrape.logger import logger
+
+REFRESH_INTERVAL = 5  # Seconds a pool capacity snapshot is reused by a gate
+MAX_PAUSE = 60  # Longest pause before a rate-limited queue is checked again
+
+
+async def get_queue_capacity(api, queue):
+    """Summarize from the pool state how many accounts can serve the queue right now."""
+    accounts = await api.pool.get_all()
+    now = datetime.now(timezone.utc)
+
+    active_accounts = [account for account in accounts if account.active]
+    lock_times = [account.locks[queue] for account in active_accounts
+                  if account.locks.get(queue) is not None and account.locks[queue] > now]
+
+    return {
+        "active": len(active_accounts),
+        "available": len(active_accounts) - len(lock_times),
+        "next_reset": min(lock_times, default=None),  # Earliest time a locked account frees up
+    }
+
+
+async def get_active_account_count(api, queue):
+    """Count the active accounts in the pool, whether or not they are rate-limited for the queue right now.
+
+    Locks expire after a few minutes, so the worker pool is sized for every account. Workers beyond the
+    currently unlocked accounts just wait in the gate (and twscrape) at no cost.
+    """
+    capacity = await get_queue_capacity(api, queue)
+    logger.info(f"Active accounts for the '{queue}' queue: {capacity['active']} "
+                f"({capacity['available']} not rate-limited right now)")
+    return capacity["active"]
+
+
+class QueueGate:
+    """Pause the workers of a queue while it is rate-limited so other queues can use the accounts."""
+
+    def __init__(self, api, queue):
+        self.api = api
+        self.queue = queue
+        self.in_flight = 0
+        self._capacity = None
+        self._checked_at = 0.0
+
+    async def capacity(self, refresh=False):
+        """Return the queue capacity, reusing a recent snapshot shared by all workers."""
+        if refresh or self._capacity is None or time.monotonic() - self._checked_at > REFRESH_INTERVAL:
+            self._capacity = await get_queue_capacity(self.api, self.queue)
+            self._checked_at = time.monotonic()
+        return self._capacity
+
+    async def __aenter__(self):
+        # Accounts locked beyond our own in-flight requests are rate-limited: sleep until the earliest reset
+        capacity = await self.capacity()
+        while capacity["available"] == 0 and 0 < capacity["active"] and self.in_flight < capacity["active"]:
+            pause = MAX_PAUSE
+            if capacity["next_reset"] is not None:
+                pause = min(max((capacity["next_reset"] - datetime.now(timezone.utc)).total_seconds(), 1), MAX_PAUSE)
+            logger.info(f"Queue '{self.queue}' is rate-limited until {capacity['next_reset']}. Pausing for {pause:.0f}s.")
+            await asyncio.sleep(pause)
+            capacity = await self.capacity(refresh=True)
+
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
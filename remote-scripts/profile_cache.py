@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import time
+import numpy as np
+from twscrape.logger import logger
+from id_batches import iter_ids
+from segment_store import iter_segment, list_segments
+
+DB_PATH = "profile_cache.db"
+MAX_ENTRIES = 1_000_000  # Profiles kept after a run; the rest is evicted
+EVICTION_POLICIES = {
+    "lru": "last_used",  # Drop the profiles that were served or fetched least recently
+    "oldest": "fetched_at",  # Drop the profiles that were fetched longest ago
+}
+COMMIT_EVERY = 1_000  # Cache writes per transaction
+QUERY_CHUNK = 500  # User IDs per lookup query (SQLite limits the number of bound parameters)
+
+# Keeps the more recently fetched copy of a profile
+UPSERT_PROFILE = (
+    "INSERT INTO profiles (user_id, profile, fetched_at, last_used) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET profile = excluded.profile, fetched_at = excluded.fetched_at, "
+    "last_used = excluded.last_used WHERE excluded.fetched_at >= profiles.fetched_at"
+)
+
+
+class ProfileCache:
+    """User profiles with their fetch time, so profiles fetched within the TTL are not requested again."""
+
+    def __init__(self, ttl_hours, db_path=DB_PATH, max_entries=MAX_ENTRIES, eviction="lru"):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.eviction = eviction
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # The segment store, not the cache, is the durable copy
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                user_id INTEGER PRIMARY KEY,
+                profile TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS profiles_fetched_at ON profiles (fetched_at);
+            CREATE INDEX IF NOT EXISTS profiles_last_used ON profiles (last_used);
+            -- user_infos segments whose profiles have been copied into the cache
+            CREATE TABLE IF NOT EXISTS seeded_segments (
+                path TEXT PRIMARY KEY
+            );
+        """)
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def _written(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def fresh_mask(self, user_ids):
+        """Boolean mask of the user IDs with a profile fetched within the TTL."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        cutoff = time.time() - self.ttl_seconds
+        fresh = np.zeros(len(user_ids), dtype=bool)
+
+        # Only the requested IDs are looked up, so a large cache is not read for a small batch or lease
+        for start in range(0, len(user_ids), QUERY_CHUNK):
+            chunk = user_ids[start:start + QUERY_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT user_id FROM profiles WHERE fetched_at >= ? AND user_id IN ({','.join('?' * len(chunk))})",
+                (cutoff, *chunk.tolist())
+            )
+            fresh_ids = np.fromiter((row[0] for row in rows), dtype=np.int64)
+            fresh[start:start + len(chunk)] = np.isin(chunk, fresh_ids)
+        return fresh
+
+    def get(self, user_id):
+        """Return the cached profile JSON of a user (or None) and mark it as used."""
+        row = self.conn.execute("SELECT profile FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE profiles SET last_used = ? WHERE user_id = ?", (time.time(), user_id))
+        self._written()
+        return row[0]
+
+    def put(self, user_id, profile, fetched_at=None):
+        """Store a profile unless the cache already holds a more recently fetched one."""
+        now = time.time()
+        self.conn.execute(UPSERT_PROFILE, (user_id, profile, fetched_at or now, now))
+        self._written()
+
+    def seed(self, user_infos_folder):
+        """Copy the profiles of user_infos segments fetched before the cache existed. Returns the number copied.
+
+        A profile is as old as the segment it was sealed in, so the segment's mtime is its fetch time.
+        """
+        seeded = {row[0] for row in self.conn.execute("SELECT path FROM seeded_segments")}
+        segments = [os.path.join(user_infos_folder, name) for name in list_segments(user_infos_folder)]
+        segments = [path for path in segments if path not in seeded]
+        if not segments:
+            return 0
+
+        logger.info(f"Seeding the profile cache from {len(segments)} user_infos segments...")
+        count = 0
+        for path in segments:
+            fetched_at = os.path.getmtime(path)
+            # Seeded profiles count as used when they were fetched, so eviction drops them before served ones
+            cursor = self.conn.executemany(UPSERT_PROFILE, ((user_id, profile, fetched_at, fetched_at)
+                                                            for user_id, profile in iter_segment(path)))
+            count += max(cursor.rowcount, 0)
+            self.conn.execute("INSERT INTO seeded_segments (path) VALUES (?)", (path,))
+            self.conn.commit()
+        logger.info(f"Seeded the profile cache with {count} profiles.")
+        return count
+
+    def skip_seeding(self, on_seal, user_infos_folder):
+        """Wrap a SegmentWriter on_seal callback so segments written with the cache on are never seeded.
+
+        Their profiles are already in the cache with their real fetch time, which may be older than the seal.
+        """
+        def record_segment(name, record_ids):
+            on_seal(name, record_ids)
+            self.conn.execute("INSERT OR IGNORE INTO seeded_segments (path) VALUES (?)",
+                              (os.path.join(user_infos_folder, name),))
+            self._written()
+        return record_segment
+
+    def evict(self):
+        """Delete profiles beyond max_entries according to the eviction policy. Returns the number deleted."""
+        count = self.conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        column = EVICTION_POLICIES[self.eviction]
+        self.conn.execute(
+            f"DELETE FROM profiles WHERE user_id IN (SELECT user_id FROM profiles ORDER BY {column} LIMIT ?)",
+            (excess,)
+        )
+        self.conn.commit()
+        return excess
+
+    def close(self):
+        """Commit pending writes, evict surplus profiles and close the database."""
+        self.conn.commit()
+        evicted = self.evict()
+        if evicted:
+            logger.info(f"Evicted {evicted} profiles from the cache ({self.eviction}).")
+        self.conn.close()
+
+
+def select_stale_users(cache, writer, checkpoint, user_ids):
+    """Write fresh cached profiles to the output and return the user IDs that still have to be fetched."""
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    fresh = cache.fresh_mask(user_ids)
+
+    # Fresh profiles already in this folder's output (e.g. from an interrupted run) are not written again
+    served = 0
+    for user_id in iter_ids(checkpoint.remaining(user_ids[fresh])):
+        profile = cache.get(user_id)
+        if profile is not None:
+            writer.write(user_id, profile)
+            served += 1
+
+    stale_user_ids = user_ids[~fresh]
+    logger.info(f"Profile cache: {int(fresh.sum())} fresh ({served} served from the cache), "
+                f"{len(stale_user_ids)} stale or missing.")
+    return stale_user_ids
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+from twscrape import API
+from twscrape.logger import set_log_level, logger
+import sys
+from pool_utils import QueueGate
+from log_utils import add_log_file
+import get_tweet_info
+import get_user_info
+import get_user_tweets
+
+# Set log level globally
+set_log_level("DEBUG")
+
+# Job type -> (module with run_job, twscrape queue it uses)
+JOBS = {
+    "tweets": (get_tweet_info, get_tweet_info.QUEUE),
+    "user_infos": (get_user_info, get_user_info.QUEUE),
+    "user_tweets": (get_user_tweets, get_user_tweets.QUEUE),
+}
+
+
+async def run_jobs(api, batch_no_str, job_types, compression=None):
+    """Run several job types on the same batch at once, sharing one account pool.
+
+    Rate limits are tracked per queue, so each job gets its own queue gate: while one queue
+    waits for its reset, the jobs on the other queues keep the accounts busy.
+    """
+    tasks = {}
+    for job_type in job_types:
+        module, queue = JOBS[job_type]
+        gate = QueueGate(api, queue)
+        if job_type == "user_tweets":
+            job = module.run_job(api, batch_no_str, gate=gate, stop_when_exhausted=False)
+        else:
+            job = module.run_job(api, batch_no_str, gate=gate, compression=compression)
+        tasks[job_type] = asyncio.create_task(job)
+        logger.info(f"Started {job_type} job for batch {batch_no_str} on the '{queue}' queue.")
+
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for job_type, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            logger.error(f"Job {job_type} failed: {result}")
+        else:
+            logger.info(f"Job {job_type} completed.")
+
+
+async def main(batch_no_str, job_types, compression=None):
+    """Main function to run the selected jobs concurrently."""
+    add_log_file(f"logs/jobs_{batch_no_str}.log")  # Save logs to a file
+    await run_jobs(API(), batch_no_str, job_types, compression)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several collection jobs on one batch with a shared account pool.")
+    parser.add_argument("batch_no", help="Batch number of the ID files to process.")
+    parser.add_argument("--jobs", nargs="+", choices=list(JOBS), default=list(JOBS),
+                        help="Job types to run together (default: all).")
+    parser.add_argument("--compress", choices=["zstd"], default=None,
+                        help="Write zstd-compressed tweet and user info segments (requires zstandard).")
+    args = parser.parse_args()
+
+    # Validate and parse batch number
+    batch_no = args.batch_no
+    if not batch_no.isdigit():
+        logger.error("<batch_no> must be an integer.")
+        sys.exit(1)
+
+    batch_no = int(batch_no)
+    batch_no_str = str(batch_no).zfill(3)
+
+    try:
+        asyncio.run(main(batch_no_str, args.jobs, args.compress))  # Pass batch_no_str to the main function
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
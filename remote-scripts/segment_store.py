@@ -0,0 +1,394 @@
+import fcntl
+import os
+from twscrape.logger import logger
+
+try:
+    import zstandard
+except ImportError:  # Only needed for compressed segments
+    zstandard = None
+
+# Segment files are append-only JSONL files. While a segment is being written it carries the
+# ".open" suffix next to an ".idx.open" index; sealing renames both so that readers only ever
+# see complete, fsync'd segments.
+SEGMENT_SUFFIX = ".jsonl"
+ZSTD_SUFFIX = ".jsonl.zst"
+INDEX_SUFFIX = ".idx"
+OPEN_SUFFIX = ".open"
+
+# Held (flock) by the SegmentWriter of a folder for as long as it may have segments open
+WRITER_LOCK_FILE = ".writer.lock"
+
+# Append-only list of sealed files (one name per line) that gather_data.py --watch polls for new data
+MANIFEST_FILE = "MANIFEST"
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+DEFAULT_MAX_RECORDS = 100_000
+DEFAULT_FRAME_BYTES = 256 * 1024  # Uncompressed bytes per independently decodable zstd frame
+
+# Index lines are "id offset length" for plain segments and
+# "id frame_offset frame_length offset_in_frame length" for zstd segments.
+PLAIN_FIELDS = 3
+ZSTD_FIELDS = 5
+
+
+def is_segment(filename):
+    """Check whether a file name is a sealed (plain or compressed) segment."""
+    return filename.endswith(SEGMENT_SUFFIX) or filename.endswith(ZSTD_SUFFIX)
+
+
+def segment_stem(name):
+    """Strip the segment suffix from a segment name."""
+    suffix = ZSTD_SUFFIX if name.endswith(ZSTD_SUFFIX) else SEGMENT_SUFFIX
+    return name[:-len(suffix)]
+
+
+def fsync_folder(folder):
+    """Flush directory entries (renames) of the folder to disk."""
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_index(index_path):
+    """Read a segment index as a list of tuples, starting with (record_id, offset, length)."""
+    entries = []
+    with open(index_path, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if not line.endswith("\n") or len(fields) not in (PLAIN_FIELDS, ZSTD_FIELDS):
+                break  # Partially written line at the end of an open index
+            entries.append(tuple(int(field) for field in fields))
+    return entries
+
+
+def format_index_entry(entry):
+    return "\t".join(str(field) for field in entry) + "\n"
+
+
+def write_index(index_path, entries):
+    """Atomically write a segment index."""
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        for entry in entries:
+            f.write(format_index_entry(entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+
+def append_manifest(folder, filenames):
+    """Durably list newly sealed files in the folder's manifest."""
+    with open(os.path.join(folder, MANIFEST_FILE), "a") as f:
+        f.writelines(f"{filename}\n" for filename in filenames)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def seal_segment(folder, name, entries):
+    """Write the final index of a segment and atomically rename it to its sealed name."""
+    segment_path = os.path.join(folder, name)
+    write_index(segment_path + INDEX_SUFFIX, entries)
+    os.replace(segment_path + OPEN_SUFFIX, segment_path)
+
+    open_index_path = segment_path + INDEX_SUFFIX + OPEN_SUFFIX
+    if os.path.exists(open_index_path):
+        os.remove(open_index_path)
+
+    fsync_folder(folder)
+    append_manifest(folder, [name, name + INDEX_SUFFIX])
+
+
+def try_lock_folder(folder):
+    """Take the folder's exclusive writer lock without waiting. Returns the lock file, or None if it is held."""
+    lock_file = open(os.path.join(folder, WRITER_LOCK_FILE), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def recover_open_segments(folder, locked=False):
+    """Seal segments left open by an interrupted run, keeping only complete records.
+
+    Open segments of a writer that is still running (it holds the folder lock) are left alone.
+    Pass locked=True when the caller already holds the folder lock.
+    """
+    open_segments = [filename for filename in sorted(os.listdir(folder))
+                     if filename.endswith(OPEN_SUFFIX) and is_segment(filename[:-len(OPEN_SUFFIX)])]
+    if not open_segments:
+        return
+
+    lock_file = None
+    if not locked:
+        lock_file = try_lock_folder(folder)
+        if lock_file is None:
+            logger.info(f"Segments in '{folder}' are being written by another process. Leaving them open.")
+            return
+
+    try:
+        for filename in open_segments:
+            _recover_open_segment(folder, filename)
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+
+def _recover_open_segment(folder, filename):
+    """Seal one open segment of an interrupted run."""
+    name = filename[:-len(OPEN_SUFFIX)]
+    segment_path = os.path.join(folder, name)
+    open_index_path = segment_path + INDEX_SUFFIX + OPEN_SUFFIX
+    entries = read_index(open_index_path) if os.path.exists(open_index_path) else []
+
+    # Only keep records (or zstd frames) that made it to disk completely
+    segment_size = os.path.getsize(segment_path + OPEN_SUFFIX)
+    entries = [entry for entry in entries if entry[1] + entry[2] <= segment_size]
+
+    if not entries:
+        os.remove(segment_path + OPEN_SUFFIX)
+        if os.path.exists(open_index_path):
+            os.remove(open_index_path)
+        logger.warning(f"Removed empty open segment: {filename}")
+        return
+
+    with open(segment_path + OPEN_SUFFIX, "r+b") as f:
+        f.truncate(entries[-1][1] + entries[-1][2])
+        os.fsync(f.fileno())
+
+    seal_segment(folder, name, entries)
+    logger.warning(f"Recovered {len(entries)} records from open segment: {filename}")
+
+
+def list_segments(folder):
+    """List the names of the sealed segments in the folder, oldest first."""
+    return sorted(
+        filename for filename in os.listdir(folder)
+        if is_segment(filename)
+        and os.path.exists(os.path.join(folder, filename + INDEX_SUFFIX))
+    )
+
+
+def read_frame(f, frame_offset, frame_length):
+    """Read and decompress a single zstd frame."""
+    if zstandard is None:
+        raise RuntimeError("Reading compressed segments requires the 'zstandard' package.")
+    f.seek(frame_offset)
+    return zstandard.ZstdDecompressor().decompress(f.read(frame_length))
+
+
+def read_record(segment_path, entry):
+    """Read a single record from a segment without scanning (or decompressing) the rest of it."""
+    with open(segment_path, "rb") as f:
+        if len(entry) == ZSTD_FIELDS:
+            _, frame_offset, frame_length, offset, length = entry
+            data = read_frame(f, frame_offset, frame_length)[offset:offset + length]
+        else:
+            _, offset, length = entry
+            f.seek(offset)
+            data = f.read(length)
+    return data.decode("utf-8").rstrip("\n")
+
+
+def iter_segment(segment_path):
+    """Yield (record_id, json_string) pairs from a sealed segment."""
+    entries = read_index(segment_path + INDEX_SUFFIX)
+    frame_offset, frame = None, None
+    with open(segment_path, "rb") as f:
+        for entry in entries:
+            if len(entry) == ZSTD_FIELDS:
+                record_id, offset, frame_length, record_offset, length = entry
+                if offset != frame_offset:  # Records of a frame are consecutive, decompress it once
+                    frame_offset, frame = offset, read_frame(f, offset, frame_length)
+                data = frame[record_offset:record_offset + length]
+            else:
+                record_id, offset, length = entry
+                f.seek(offset)
+                data = f.read(length)
+            yield record_id, data.decode("utf-8").rstrip("\n")
+
+
+def iter_records(folder):
+    """Yield (record_id, json_string) pairs from sealed segments and legacy per-ID JSON files."""
+    for name in list_segments(folder):
+        yield from iter_segment(os.path.join(folder, name))
+
+    # Compatibility with the one-file-per-ID layout
+    for filename in os.listdir(folder):
+        if filename.endswith(".json"):
+            try:
+                record_id = int(filename.replace(".json", ""))
+            except ValueError:
+                continue
+            with open(os.path.join(folder, filename), "r") as f:
+                yield record_id, f.read()
+
+
+def get_collected_ids(folder):
+    """Retrieve a set of record IDs already stored in the folder (segments and per-ID files)."""
+    recover_open_segments(folder)
+
+    collected_ids = set()
+    for name in list_segments(folder):
+        for entry in read_index(os.path.join(folder, name + INDEX_SUFFIX)):
+            collected_ids.add(entry[0])
+
+    for filename in os.listdir(folder):
+        if filename.endswith(".json"):
+            try:
+                collected_ids.add(int(filename.replace(".json", "")))
+            except ValueError:
+                logger.warning(f"Invalid file name in {folder} folder: {filename}")
+    return collected_ids
+
+
+class SegmentWriter:
+    """Append records to rolling JSONL segments capped by size or record count.
+
+    With compression="zstd" records are buffered and written as independent zstd frames of about
+    frame_bytes each, so a single record can be read by decompressing only its frame.
+    """
+
+    def __init__(self, folder, prefix, max_bytes=DEFAULT_MAX_BYTES, max_records=DEFAULT_MAX_RECORDS, on_seal=None,
+                 compression=None, frame_bytes=DEFAULT_FRAME_BYTES):
+        if compression not in (None, "zstd"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package (pip install zstandard).")
+
+        self.folder = folder
+        self.prefix = prefix
+        self.max_bytes = max_bytes  # Uncompressed size of the records in a segment
+        self.max_records = max_records
+        self.on_seal = on_seal  # Called with (segment_name, record_ids) once a segment is sealed
+        self.compression = compression
+        self.frame_bytes = frame_bytes
+        self.suffix = ZSTD_SUFFIX if compression == "zstd" else SEGMENT_SUFFIX
+        self._compressor = zstandard.ZstdCompressor(write_content_size=True) if compression == "zstd" else None
+
+        os.makedirs(folder, exist_ok=True)
+        # Held until close() so no other process recovers (seals) the segments this writer has open
+        self._lock_file = try_lock_folder(folder)
+        if self._lock_file is None:
+            raise RuntimeError(f"Another process is already writing segments to '{folder}'.")
+        recover_open_segments(folder, locked=True)
+
+        self._next_seq = self._find_next_sequence()
+        self._name = None
+        self._file = None
+        self._index_file = None
+        self._entries = []
+        self._offset = 0  # Position in the segment file
+        self._size = 0  # Uncompressed bytes written to the segment
+        self._frame = []  # (record_id, line) pairs waiting to be compressed
+        self._frame_size = 0
+
+    def _find_next_sequence(self):
+        """Continue numbering after the last sealed segment of this prefix."""
+        sequences = []
+        for name in list_segments(self.folder):
+            stem = segment_stem(name)
+            if stem.startswith(f"{self.prefix}_") and stem.rsplit("_", 1)[-1].isdigit():
+                sequences.append(int(stem.rsplit("_", 1)[-1]))
+        return max(sequences, default=0) + 1
+
+    def _open_segment(self):
+        self._name = f"{self.prefix}_{self._next_seq:06}{self.suffix}"
+        self._next_seq += 1
+        segment_path = os.path.join(self.folder, self._name)
+        self._file = open(segment_path + OPEN_SUFFIX, "wb")
+        self._index_file = open(segment_path + INDEX_SUFFIX + OPEN_SUFFIX, "w")
+        self._entries = []
+        self._offset = 0
+        self._size = 0
+
+    def _add_entry(self, entry):
+        self._index_file.write(format_index_entry(entry))
+        self._entries.append(entry)
+
+    def _flush_frame(self):
+        """Compress the buffered records into one frame and index them by frame offset."""
+        if not self._frame:
+            return
+
+        data = self._compressor.compress(b"".join(line for _, line in self._frame))
+        self._file.write(data)
+
+        record_offset = 0
+        for record_id, line in self._frame:
+            self._add_entry((record_id, self._offset, len(data), record_offset, len(line)))
+            record_offset += len(line)
+
+        self._offset += len(data)
+        self._frame = []
+        self._frame_size = 0
+
+    def write(self, record_id, data):
+        """Append one JSON record and roll over to a new segment when the current one is full."""
+        if self._file is None:
+            self._open_segment()
+
+        line = data.replace("\n", " ").encode("utf-8") + b"\n"
+        if self._compressor is None:
+            self._file.write(line)
+            self._add_entry((record_id, self._offset, len(line)))
+            self._offset += len(line)
+        else:
+            self._frame.append((record_id, line))
+            self._frame_size += len(line)
+            if self._frame_size >= self.frame_bytes:
+                self._flush_frame()
+        self._size += len(line)
+
+        if self._size >= self.max_bytes or len(self._entries) + len(self._frame) >= self.max_records:
+            self.seal()
+
+    def flush(self):
+        """Make the records written so far durable without sealing the segment (recovered after a crash)."""
+        if self._file is None:
+            return
+
+        if self._compressor is not None:
+            self._flush_frame()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+    def seal(self):
+        """Fsync the current segment and atomically publish it with its index."""
+        if self._file is None:
+            return
+
+        if self._compressor is not None:
+            self._flush_frame()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._index_file.close()
+
+        seal_segment(self.folder, self._name, self._entries)
+        logger.info(f"Sealed segment {self._name} with {len(self._entries)} records.")
+        if self.on_seal:
+            self.on_seal(self._name, [entry[0] for entry in self._entries])
+
+        self._file = None
+        self._index_file = None
+
+    def close(self):
+        """Seal the segment in progress, if any, and release the folder lock."""
+        try:
+            self.seal()
+        finally:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
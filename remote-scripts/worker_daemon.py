@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+from twscrape import API
+from twscrape.logger import set_log_level, logger
+import sys
+from pool_utils import QueueGate
+from log_utils import add_log_file
+import job_queue
+import get_tweet_info
+import get_user_info
+import get_user_tweets
+
+# Set log level globally
+set_log_level("DEBUG")
+
+# Job type -> module with run_job
+JOB_MODULES = {
+    "tweets": get_tweet_info,
+    "user_infos": get_user_info,
+    "user_tweets": get_user_tweets,
+}
+
+POLL_INTERVAL = 5  # Seconds between checks for new jobs
+
+
+def start_job(api, gates, job):
+    """Start a claimed job as a task on the warm API and account pool."""
+    job_type = job["job_type"]
+    module = JOB_MODULES[job_type]
+    gate = gates[job_type]
+    options = job_queue.job_options(job)  # Options given with --submit (e.g. --workers, --compress)
+
+    if job_type == "user_tweets":
+        # A long-running daemon waits for rate-limit resets instead of stopping the job
+        options["stop_when_exhausted"] = False
+    elif job_type == "user_infos":
+        options["cache"] = module.open_cache(options.pop("ttl_hours", None),
+                                             **{key: options.pop(key) for key in ("cache_size", "eviction")
+                                                if key in options})
+    coro = module.run_job(api, job["batch_no"], gate=gate, id_file=job["id_file"], **options)
+
+    logger.info(f"Started job {job['id']}: {job_type} for batch {job['batch_no']}.")
+    return asyncio.create_task(coro)
+
+
+async def serve(poll_interval=POLL_INTERVAL):
+    """Run queued jobs, at most one per job type at a time, until the daemon is stopped."""
+    add_log_file("logs/worker_daemon.log")
+
+    # A second daemon would requeue (and run again) the jobs this one is running
+    lock_file = job_queue.lock_daemon()
+    if lock_file is None:
+        logger.error("Another worker daemon is already running in this folder. Exiting.")
+        return
+
+    api = API()
+    gates = {job_type: QueueGate(api, module.QUEUE) for job_type, module in JOB_MODULES.items()}
+    conn = job_queue.connect()
+
+    requeued = job_queue.requeue_interrupted_jobs(conn)
+    if requeued:
+        logger.warning(f"Requeued {requeued} jobs interrupted by the last shutdown.")
+
+    running = {}  # job_type -> (job_id, task)
+    logger.info("Worker daemon started. Waiting for jobs...")
+
+    try:
+        while True:
+            # Record finished jobs
+            for job_type, (job_id, task) in list(running.items()):
+                if task.done():
+                    error = None
+                    if task.exception() is not None:
+                        error = str(task.exception())
+                        logger.error(f"Job {job_id} ({job_type}) failed: {error}")
+                    else:
+                        logger.info(f"Job {job_id} ({job_type}) completed.")
+                    job_queue.finish_job(conn, job_id, error)
+                    del running[job_type]
+
+            # Jobs of the same type write to the same folder, so they run one after another
+            job = job_queue.claim_next_job(conn, list(running))
+            if job is not None:
+                running[job["job_type"]] = (job["id"], start_job(api, gates, job))
+                continue
+
+            await asyncio.sleep(poll_interval)
+    finally:
+        for job_id, task in running.values():
+            task.cancel()
+        await asyncio.gather(*[task for _, task in running.values()], return_exceptions=True)
+        conn.close()
+        lock_file.close()
+
+
+def print_status(limit):
+    """Print the most recent jobs and their state."""
+    conn = job_queue.connect()
+    try:
+        jobs = job_queue.list_jobs(conn, limit)
+    finally:
+        conn.close()
+
+    if not jobs:
+        print("No jobs submitted yet.")
+        return
+
+    for job in jobs:
+        line = (f"{job['id']:>5}  {job['job_type']:<12} batch {job['batch_no']}  {job['status']:<8} "
+                f"submitted {job['submitted_at']}  started {job['started_at'] or '-'}  "
+                f"finished {job['finished_at'] or '-'}")
+        if job["options"]:
+            line += f"  options: {job['options']}"
+        if job["error"]:
+            line += f"  error: {job['error']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent worker that runs collection jobs from a local queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run queued jobs until stopped.")
+    serve_parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                              help="Seconds between checks for new jobs.")
+
+    submit_parser = subparsers.add_parser("submit", help="Queue a job.")
+    submit_parser.add_argument("job_type", choices=list(JOB_MODULES), help="Type of job to run.")
+    submit_parser.add_argument("batch_no", help="Batch number of the ID file to process.")
+    submit_parser.add_argument("--id-file", default=None, help="ID file to process (default: the batch's ID file).")
+
+    status_parser = subparsers.add_parser("status", help="Show the most recent jobs.")
+    status_parser.add_argument("--limit", type=int, default=20, help="Number of jobs to show.")
+
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        if not args.batch_no.isdigit():
+            logger.error("<batch_no> must be an integer.")
+            sys.exit(1)
+        batch_no_str = str(int(args.batch_no)).zfill(3)
+        job_id = job_queue.submit_job(args.job_type, batch_no_str, args.id_file)
+        logger.info(f"Submitted {args.job_type} job {job_id} for batch {batch_no_str}.")
+    elif args.command == "status":
+        print_status(args.limit)
+    else:
+        try:
+            asyncio.run(serve(args.poll_interval))
+        except KeyboardInterrupt:
+            logger.info("Worker daemon stopped.")
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
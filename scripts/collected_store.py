@@ -0,0 +1,269 @@
+import argparse
+import fcntl
+import glob
+import json
+import os
+import sys
+import time
+import logging
+from contextlib import contextmanager
+import numpy as np
+
+# The ID parsing and lookup helpers are shared with the remote scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remote-scripts"))
+from id_arrays import sorted_contains
+
+# Persistent index of every ID gathered so far, kept per data type in output/dedup/<data_type>/:
+#   part_NNNNNN.npy  sorted int64 array of IDs first gathered by one run (parts never overlap)
+#   catalog.json     the parts with the run and data folder their IDs were gathered to
+# gather_data.py adds each gathered folder, split_id_batches.py --exclude-collected subtracts the store.
+DEDUP_FOLDER = "output/dedup"
+DATA_TYPES = ("tweets", "user_infos", "user_tweets", "keyword_tweets")
+CATALOG_FILE = "catalog.json"
+LOCK_FILE = ".lock"
+
+MAX_RUN_PARTS = 8  # Parts of one run (e.g. one per watch poll) are merged once there are more
+INDEX_SUFFIX = ".idx"
+
+
+class CollectedStore:
+    """Sorted ID arrays of all gathered runs of one data type, memory-mapped for lookups."""
+
+    def __init__(self, data_type, root=DEDUP_FOLDER):
+        self.data_type = data_type
+        self.folder = os.path.join(root, data_type)
+        os.makedirs(self.folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        catalog_path = os.path.join(self.folder, CATALOG_FILE)
+        if os.path.exists(catalog_path):
+            with open(catalog_path, "r") as f:
+                self.catalog = json.load(f)
+        else:
+            self.catalog = {"next_part": 1, "parts": []}
+        self._arrays = [np.load(os.path.join(self.folder, part["file"]), mmap_mode="r")
+                        for part in self.catalog["parts"]]
+
+    def _save_catalog(self):
+        catalog_path = os.path.join(self.folder, CATALOG_FILE)
+        tmp_path = f"{catalog_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.catalog, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, catalog_path)
+
+    def _write_part(self, ids):
+        file_name = f"part_{self.catalog['next_part']:06}.npy"
+        self.catalog["next_part"] += 1
+        tmp_path = os.path.join(self.folder, f"{file_name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, ids)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.folder, file_name))
+        return file_name
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers (e.g. two gathers of the same data type) and reload the catalog under the lock."""
+        with open(os.path.join(self.folder, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return sum(part["count"] for part in self.catalog["parts"])
+
+    def lookup(self, ids):
+        """Index into catalog["parts"] of the part holding each ID, or -1 for IDs not collected yet."""
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.full(len(ids), -1, dtype=np.int32)
+        for i, array in enumerate(self._arrays):
+            found[sorted_contains(array, ids)] = i
+        return found
+
+    def contains(self, ids):
+        """Boolean mask of the IDs that were already collected."""
+        ids = np.asarray(ids, dtype=np.int64)
+        collected = np.zeros(len(ids), dtype=bool)
+        for array in self._arrays:
+            collected |= sorted_contains(array, ids)
+        return collected
+
+    def remaining(self, ids):
+        """Return the IDs that were not collected yet, preserving their order."""
+        ids = np.asarray(ids, dtype=np.int64)
+        return ids[~self.contains(ids)]
+
+    def add(self, ids, run, path):
+        """Add the IDs gathered by a run that are not in the store yet. Returns the number of new IDs."""
+        with self._locked():
+            new_ids = self.remaining(np.unique(np.asarray(ids, dtype=np.int64)))
+            if len(new_ids):
+                file_name = self._write_part(new_ids)
+                self.catalog["parts"].append({
+                    "file": file_name, "run": run, "path": path, "count": int(len(new_ids)),
+                    "added_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                })
+                self._merge_run_parts(run)
+                self._save_catalog()
+                self._load()
+            return int(len(new_ids))
+
+    def _merge_run_parts(self, run):
+        """Merge the parts of a run into one once it has more than MAX_RUN_PARTS."""
+        run_parts = [part for part in self.catalog["parts"] if part["run"] == run]
+        if len(run_parts) <= MAX_RUN_PARTS:
+            return
+
+        # Parts are disjoint, so sorting their concatenation is enough
+        merged = np.sort(np.concatenate([np.load(os.path.join(self.folder, part["file"])) for part in run_parts]))
+        file_name = self._write_part(merged)
+        first = self.catalog["parts"].index(run_parts[0])
+        self.catalog["parts"] = [part for part in self.catalog["parts"] if part["run"] != run]
+        self.catalog["parts"].insert(first, {
+            "file": file_name, "run": run, "path": run_parts[-1]["path"], "count": int(len(merged)),
+            "added_at": run_parts[-1]["added_at"],
+        })
+        self._save_catalog()
+
+        # Old parts are only removed once the catalog no longer refers to them
+        for part in run_parts:
+            os.remove(os.path.join(self.folder, part["file"]))
+        logging.info(f"Merged {len(run_parts)} {self.data_type} parts of run {run} into {file_name}.")
+
+    def runs(self):
+        """Number of stored IDs per run, in the order the runs were added."""
+        counts = {}
+        for part in self.catalog["parts"]:
+            counts[part["run"]] = counts.get(part["run"], 0) + part["count"]
+        return counts
+
+
+# Read gathered folders
+def read_index_ids(index_path):
+    """Read the record IDs (first field) of a segment index, skipping a partial last line."""
+    ids = []
+    with open(index_path, "r") as f:
+        for line in f:
+            if line.endswith("\n"):
+                ids.append(int(line.split("\t", 1)[0]))
+    return ids
+
+
+def list_gathered_files(folder):
+    """Paths (relative to the folder) of its files and of the files in its per-server subfolders."""
+    names = []
+    for entry in os.scandir(folder):
+        if entry.is_dir():
+            names.extend(os.path.join(entry.name, name) for name in os.listdir(entry.path))
+        else:
+            names.append(entry.name)
+    return names
+
+
+def folder_ids(folder, data_type, names=None):
+    """Collect the IDs stored in a gathered data folder, or only in the listed files (relative paths)."""
+    if names is None:
+        names = list_gathered_files(folder)
+
+    arrays = []
+    file_ids = []
+    for path in names:
+        name = os.path.basename(path)
+        if data_type == "user_tweets":
+            # One <user_id>.jsonl file per finished timeline
+            stem = name[:-len(".jsonl")] if name.endswith(".jsonl") else None
+        else:
+            stem = name[:-len(".json")] if name.endswith(".json") else None  # One-file-per-ID layout
+            if name.endswith(INDEX_SUFFIX) and os.path.exists(os.path.join(folder, path)):
+                arrays.append(np.array(read_index_ids(os.path.join(folder, path)), dtype=np.int64))
+        if stem is not None and stem.isdigit():
+            file_ids.append(int(stem))
+
+    arrays.append(np.array(file_ids, dtype=np.int64))
+    return np.concatenate(arrays)
+
+
+def add_gathered_folder(data_folder, data_type, names=None, root=DEDUP_FOLDER):
+    """Add the IDs of data/<run>/<data_type>/<server> (or only of the listed files) to the store."""
+    folder = os.path.join(data_folder, data_type)
+    if not os.path.isdir(folder):
+        return 0
+
+    run = os.path.basename(os.path.normpath(data_folder))
+    ids = folder_ids(folder, data_type, names)
+    new_count = CollectedStore(data_type, root).add(ids, run, folder)
+    logging.info(f"Indexed {len(ids)} {data_type} IDs of run {run}: {new_count} new in the collected store.")
+    return new_count
+
+
+def print_status(root=DEDUP_FOLDER):
+    """Print the number of stored IDs per data type and run."""
+    for data_type in DATA_TYPES:
+        if not os.path.exists(os.path.join(root, data_type, CATALOG_FILE)):
+            continue
+        store = CollectedStore(data_type, root)
+        print(f"{data_type:<12} {len(store):>12} IDs in {len(store.catalog['parts'])} parts")
+        for run, count in store.runs().items():
+            print(f"  {run:<30} {count:>12}")
+
+
+# Main execution
+if __name__ == "__main__":
+    LOG_FILE = "logs/collected_store.log"
+    os.makedirs("logs", exist_ok=True)
+
+    logging.basicConfig(
+        filename=LOG_FILE,
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] - %(message)s", "%Y-%m-%d %H:%M:%S")
+    console_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(console_handler)
+
+    parser = argparse.ArgumentParser(description="Index of all IDs gathered so far, across runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Add gathered data folders (e.g. earlier runs) to the store.")
+    add_parser.add_argument("data_folders", nargs="*",
+                            help="Gathered run folders (default: every data/*/ folder).")
+    add_parser.add_argument("--type", nargs="+", choices=DATA_TYPES, default=list(DATA_TYPES),
+                            help="Data types to index (default: all).")
+
+    lookup_parser = subparsers.add_parser("lookup", help="Show the run that collected each ID.")
+    lookup_parser.add_argument("data_type", choices=DATA_TYPES, help="Data type of the IDs.")
+    lookup_parser.add_argument("ids", nargs="+", type=int, help="IDs to look up.")
+
+    subparsers.add_parser("status", help="Show the number of stored IDs per data type and run.")
+
+    args = parser.parse_args()
+
+    if args.command == "add":
+        data_folders = args.data_folders or sorted(glob.glob("data/*/"))
+        for data_folder in data_folders:
+            if not os.path.isdir(data_folder):
+                logging.error(f"Data folder '{data_folder}' not found.")
+                sys.exit(1)
+        for data_folder in data_folders:
+            for data_type in args.type:
+                add_gathered_folder(data_folder, data_type)
+    elif args.command == "lookup":
+        store = CollectedStore(args.data_type)
+        for record_id, part in zip(args.ids, store.lookup(args.ids)):
+            if part < 0:
+                print(f"{record_id}  not collected")
+            else:
+                print(f"{record_id}  {store.catalog['parts'][part]['run']}  {store.catalog['parts'][part]['path']}")
+    else:
+        print_status()
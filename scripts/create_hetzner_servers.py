@@ -1,8 +1,11 @@
+import argparse
 import json
-import pandas as pd
 import sys
 import os
 import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hcloud import Client
 from hcloud.images import Image
 from hcloud.server_types import ServerType
@@ -31,6 +34,35 @@ logging.getLogger().addHandler(console_handler)
 # Load configuration
 CONFIG_PATH = "config/config.json"
 
+# Server inventory read by the orchestration scripts
+SERVERS_FILE = "output/hetzner_servers.json"
+SERVERS_EXCEL_FILE = "output/hetzner_servers.xlsx"
+
+SERVER_ROLE = "data-collection"
+MAX_WORKERS = 10  # Servers created and awaited at the same time
+SSH_TIMEOUT = 300  # Seconds to wait for a new server to accept SSH connections
+SSH_POLL_INTERVAL = 5
+
+
+def fleet_label_selector(server_name):
+    """Label selector matching the servers created with the given name prefix."""
+    return f"role={SERVER_ROLE},fleet={server_name}"
+
+
+def wait_for_ssh(ip, timeout=SSH_TIMEOUT, poll_interval=SSH_POLL_INTERVAL):
+    """Wait until the SSH daemon on the server answers with its banner. Returns True if it did in time."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((ip, 22), timeout=poll_interval) as sock:
+                sock.settimeout(poll_interval)
+                if sock.recv(4).startswith(b"SSH-"):
+                    return True
+        except OSError:
+            pass
+        time.sleep(poll_interval)
+    return False
+
 def load_config():
     """Loads the configuration from a JSON file."""
     try:
@@ -45,49 +77,93 @@ def load_config():
 
 
 # Create servers
-def create_servers(client, num_servers, server_name, config):
-    """Creates a specified number of servers on Hetzner."""
+def create_server(client, server_name, i, config, is_reachable=wait_for_ssh):
+    """Creates one server and waits until its create actions are finished and SSH is reachable."""
+    server_label = f"{server_name}-{i:03}"
+    response = client.servers.create(
+        name=server_label,
+        server_type=ServerType(name=config["server_type"]),
+        image=Image(id=config["image_id"]),
+        ssh_keys=[SSHKey(name=config["ssh_key_name"])],
+        labels={"role": SERVER_ROLE, "fleet": server_name, "batch": f"batch-{i:03}"},
+        location=Location(name=config["location"])
+    )
+    server = response.server
+    logging.info(f"Created server: {server.name} (Status: {server.status})")
+
+    # Wait for the create action and follow-up actions (e.g. start_server) to finish
+    response.action.wait_until_finished()
+    for action in response.next_actions or []:
+        action.wait_until_finished()
+
+    ip = server.public_net.ipv4.ip
+    if not is_reachable(ip):
+        raise TimeoutError(f"SSH on {ip} not reachable after {SSH_TIMEOUT}s")
+    logging.info(f"Server ready: {server.name} ({ip})")
+    return server.name
+
+
+def create_servers(client, num_servers, server_name, config, workers=MAX_WORKERS, is_reachable=wait_for_ssh):
+    """Creates a specified number of servers on Hetzner in parallel.
+
+    Returns the names of the ready servers and of the created servers that never became reachable.
+    """
     created_servers = []
+    unreachable_servers = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(create_server, client, server_name, i, config, is_reachable): f"{server_name}-{i:03}"
+            for i in range(1, num_servers + 1)
+        }
+        for future in as_completed(futures):
+            try:
+                created_servers.append(future.result())
+            except TimeoutError as e:
+                logging.error(f"Server {futures[future]} was created but is not usable: {e}")
+                unreachable_servers.append(futures[future])
+            except Exception as e:
+                logging.error(f"Error creating server {futures[future]}: {e}")
+
+    logging.info(f"{len(created_servers)} of {num_servers} servers are ready.")
+    return sorted(created_servers), sorted(unreachable_servers)
 
-    for i in range(1, num_servers + 1):
-        server_label = f"{server_name}-{i:03}"
-        try:
-            response = client.servers.create(
-                name=server_label,
-                server_type=ServerType(name=config["server_type"]),
-                image=Image(id=config["image_id"]),
-                ssh_keys=[SSHKey(name=config["ssh_key_name"])],
-                labels={"role": "data-collection", "batch": f"batch-{i:03}"},
-                location=Location(name=config["location"])
-            )
-            server = response.server
-            logging.info(f"Created server: {server.name} (Status: {server.status})")
-            created_servers.append(server.name)
-        except Exception as e:
-            logging.error(f"Error creating server {server_label}: {e}")
-
-    return created_servers
+
+# Save server inventory
+def save_server_inventory(server_data, output_file=SERVERS_FILE):
+    """Atomically writes the server inventory as a JSON list of {"Name", "IP"} records."""
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(server_data, f, indent=2)
+    os.replace(tmp_file, output_file)
+    logging.info(f"Server details saved to {output_file}")
+
+
+def export_server_inventory_excel(server_data, output_file=SERVERS_EXCEL_FILE):
+    """Exports the server inventory to an Excel file (optional, requires pandas and openpyxl)."""
+    import pandas as pd
+
+    pd.DataFrame(server_data, columns=["Name", "IP"]).to_excel(output_file, index=False)
+    logging.info(f"Server details exported to {output_file}")
 
 
 # Fetch and save server details
-def fetch_and_save_server_data(client, server_name, output_file):
-    """Fetches all Hetzner servers matching the given prefix and saves details to an Excel file."""
+def fetch_and_save_server_data(client, server_name, output_file=SERVERS_FILE, excel=False, failed_servers=()):
+    """Fetches the running servers of the fleet by label and saves their details to the inventory."""
     try:
-        servers = client.servers.get_all()
+        servers = client.servers.get_all(label_selector=fleet_label_selector(server_name))
         server_data = []
 
-        for server in servers:
-            if server.name.startswith(server_name):
+        for server in sorted(servers, key=lambda server: server.name):
+            # Servers that did not become reachable are left out of the inventory
+            if server.status == "running" and server.name not in failed_servers:
                 ip = server.public_net.ipv4.ip
                 server_data.append({"Name": server.name, "IP": ip})
 
-        df = pd.DataFrame(server_data)
-
-        if not os.path.exists("output"):
-            os.makedirs("output")
-
-        df.to_excel(output_file, index=False)
-        logging.info(f"Server details saved to {output_file}")
+        save_server_inventory(server_data, output_file)
+        if excel:
+            export_server_inventory_excel(server_data)
 
     except Exception as e:
         logging.error(f"Error fetching server data: {e}")
@@ -95,12 +171,17 @@ def fetch_and_save_server_data(client, server_name, output_file):
 
 # Main execution
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        logging.error("Usage: python create_hetzner_servers.py <num_servers> <server_name>")
-        sys.exit(1)
-
-    num_servers = sys.argv[1]
-    server_name = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Create data collection servers on Hetzner.")
+    parser.add_argument("num_servers", help="Number of servers to create.")
+    parser.add_argument("server_name", help="Name prefix of the servers (e.g. tw -> tw-001, tw-002, ...).")
+    parser.add_argument("--excel", action="store_true",
+                        help=f"Also export the server inventory to {SERVERS_EXCEL_FILE}.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Number of servers to create and wait for in parallel (default: {MAX_WORKERS}).")
+    args = parser.parse_args()
+
+    num_servers = args.num_servers
+    server_name = args.server_name
 
     if not num_servers.isdigit():
         logging.error("<num_servers> must be an integer.")
@@ -108,6 +189,10 @@ if __name__ == "__main__":
 
     num_servers = int(num_servers)
 
+    if args.workers < 1:
+        logging.error("--workers must be a positive integer.")
+        sys.exit(1)
+
     # Load configuration
     config = load_config()
 
@@ -121,10 +206,10 @@ if __name__ == "__main__":
     client = Client(token=api_token)
 
     # Create servers
-    created_servers = create_servers(client, num_servers, server_name, config)
+    created_servers, unreachable_servers = create_servers(client, num_servers, server_name, config, args.workers)
 
     if created_servers:
-        # Fetch and save server data
-        fetch_and_save_server_data(client, server_name, "output/hetzner_servers.xlsx")
+        # Fetch and save server data once the servers are usable
+        fetch_and_save_server_data(client, server_name, SERVERS_FILE, args.excel, unreachable_servers)
     else:
         logging.warning("No servers were created.")
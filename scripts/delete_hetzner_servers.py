@@ -1,7 +1,9 @@
+import argparse
 import json
 import sys
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hcloud import Client
 
 # Logging setup
@@ -38,46 +40,112 @@ def load_config():
         sys.exit(1)
 
 
+SERVER_ROLE = "data-collection"
+MAX_WORKERS = 10  # Deletes issued and awaited at the same time
+
+
+def fleet_label_selector(server_name, batch_no=None):
+    """Label selector for the servers created with the given name prefix (and optionally one batch)."""
+    selector = f"role={SERVER_ROLE},fleet={server_name}"
+    if batch_no is not None:
+        selector += f",batch=batch-{batch_no:03}"
+    return selector
+
+
+def is_legacy_fleet_server(server, server_name, batch_no=None):
+    """Check whether a server without a fleet label is <server_name>-NNN (and of the given batch)."""
+    if "fleet" in (server.labels or {}):
+        return False
+    prefix, _, number = server.name.rpartition("-")
+    if prefix != server_name or not number.isdigit():
+        return False
+    return batch_no is None or int(number) == batch_no
+
+
+def find_fleet_servers(client, server_name, batch_no=None):
+    """Servers of a fleet by label, plus those created before the fleet label existed, matched by name."""
+    servers = {server.id: server
+               for server in client.servers.get_all(label_selector=fleet_label_selector(server_name, batch_no))}
+
+    # Older servers only carry the role and batch labels
+    for server in client.servers.get_all(label_selector=f"role={SERVER_ROLE},!fleet"):
+        if is_legacy_fleet_server(server, server_name, batch_no):
+            servers.setdefault(server.id, server)
+    return sorted(servers.values(), key=lambda server: server.name)
+
+
+def delete_server(server):
+    """Deletes one server and waits until the delete action has finished."""
+    action = server.delete()
+    if action is not None:
+        action.wait_until_finished()
+    return server
+
+
 # Delete servers
-def delete_servers(client, server_name):
-    """Deletes all servers with the specified name prefix."""
-    servers = client.servers.get_all()
-    matching_servers = [server for server in servers if server.name.startswith(server_name)]
+def delete_servers(client, server_name, batch_no=None, assume_yes=False, workers=MAX_WORKERS):
+    """Deletes the servers of a fleet in parallel. Returns False if some are left."""
+    label_selector = fleet_label_selector(server_name, batch_no)
+    matching_servers = find_fleet_servers(client, server_name, batch_no)
 
     if not matching_servers:
-        logging.info(f"No servers found with prefix '{server_name}'")
-        print(f"No servers found with prefix '{server_name}'")
-        return
+        logging.info(f"No servers found with labels '{label_selector}' or named '{server_name}-NNN'")
+        print(f"No servers found with labels '{label_selector}' or named '{server_name}-NNN'")
+        return True
 
     print("\nThe following servers will be deleted:")
     for server in matching_servers:
         print(f" - {server.name} (ID: {server.id})")
 
-    confirm = input("\nAre you sure you want to delete these servers? (yes/no): ").strip().lower()
-    if confirm != "yes":
-        logging.info("Server deletion aborted by user.")
-        print("Aborting deletion.")
-        return
-
-    for server in matching_servers:
-        try:
-            server.delete()
-            logging.info(f"Deleted server: {server.name} (ID: {server.id})")
-            print(f"Deleted server: {server.name} (ID: {server.id})")
-        except Exception as e:
-            logging.error(f"Failed to delete server {server.name} (ID: {server.id}): {e}")
-            print(f"Error: Could not delete {server.name} (ID: {server.id})")
+    if not assume_yes:
+        confirm = input("\nAre you sure you want to delete these servers? (yes/no): ").strip().lower()
+        if confirm != "yes":
+            logging.info("Server deletion aborted by user.")
+            print("Aborting deletion.")
+            return True
+
+    # Issue all deletes at once and wait for their actions together
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(delete_server, server): server for server in matching_servers}
+        for future in as_completed(futures):
+            server = futures[future]
+            try:
+                future.result()
+                logging.info(f"Deleted server: {server.name} (ID: {server.id})")
+                print(f"Deleted server: {server.name} (ID: {server.id})")
+            except Exception as e:
+                logging.error(f"Failed to delete server {server.name} (ID: {server.id}): {e}")
+                print(f"Error: Could not delete {server.name} (ID: {server.id})")
+
+    # Make sure nothing billable is left behind
+    remaining = find_fleet_servers(client, server_name, batch_no)
+    if remaining:
+        names = ", ".join(server.name for server in remaining)
+        logging.error(f"{len(remaining)} servers are still present after deletion: {names}")
+        print(f"Error: {len(remaining)} servers are still present: {names}")
+        return False
+
+    logging.info(f"All {len(matching_servers)} servers of fleet '{server_name}' are deleted.")
+    print(f"All {len(matching_servers)} servers are deleted.")
+    return True
 
 
 # Main execution
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        logging.error("Usage: python delete_hetzner_servers.py <server_name_prefix>")
-        print("Usage: python delete_hetzner_servers.py <server_name_prefix>")
+    parser = argparse.ArgumentParser(description="Delete data collection servers on Hetzner by label.")
+    parser.add_argument("server_name",
+                        help="Name prefix the servers were created with (their fleet label). Servers without a "
+                             "fleet label are matched by name (<server_name>-NNN).")
+    parser.add_argument("--batch", type=int, default=None, help="Only delete the server of this batch number.")
+    parser.add_argument("--yes", action="store_true", help="Delete without asking for confirmation.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Number of servers to delete in parallel (default: {MAX_WORKERS}).")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        logging.error("--workers must be a positive integer.")
         sys.exit(1)
 
-    server_name = sys.argv[1]
-
     # Load configuration
     config = load_config()
 
@@ -91,4 +159,5 @@ if __name__ == "__main__":
     client = Client(token=api_token)
 
     # Delete servers
-    delete_servers(client, server_name)
+    if not delete_servers(client, args.server_name, args.batch, args.yes, args.workers):
+        sys.exit(1)
@@ -1,10 +1,16 @@
 import argparse
 import os
 import json
-import pandas as pd
+import re
+import shlex
+import shutil
 import subprocess
 import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from collected_store import add_gathered_folder
 
 # Logging setup
 LOG_FILE = "logs/gather_data.log"
@@ -25,6 +31,28 @@ logging.getLogger().addHandler(console_handler)
 
 # Load configuration
 CONFIG_PATH = "config/config.json"
+SERVERS_FILE = "output/hetzner_servers.json"
+SERVERS_EXCEL_FILE = "output/hetzner_servers.xlsx"
+
+MAX_WORKERS = 10  # Servers gathered at the same time
+RSYNC_RETRIES = 3  # Attempts per rsync call
+RETRY_BACKOFF = 10  # Seconds before the first retry, doubled after every failed attempt
+RSYNC_PARTIAL_TRANSFER = 23  # rsync exit code when some files could not be transferred (e.g. missing)
+RSYNC_PARTIAL_VANISHED = 24  # rsync exit code when source files vanished during the transfer
+SSH_CONNECTION_ERROR = 255  # ssh exit code when the connection itself failed
+
+# Watch mode: remote scripts append every sealed file to <data_type>/MANIFEST
+MANIFEST_FILE = "MANIFEST"
+WATCH_INTERVAL = 60  # Seconds between manifest polls
+WATCH_STATE_FOLDER = "output/watch"  # Manifest offsets per --desc, kept across days (data folders are dated)
+CONTROL_PERSIST = 300  # Seconds an idle shared SSH connection stays open between polls
+
+# Files that are still being written (or only used by the remote scripts) are never gathered
+RSYNC_EXCLUDES = [
+    "--exclude=*.open", "--exclude=*.part", "--exclude=*.cursor", "--exclude=*.tmp", "--exclude=*.lock",
+    "--exclude=.collected_*",
+    f"--exclude={MANIFEST_FILE}",
+]
 
 def load_config():
     """Loads configuration from config.json."""
@@ -39,9 +67,20 @@ def load_config():
         exit(1)
 
 def load_server_details():
-    """Loads Hetzner server details from the Excel file."""
+    """Loads Hetzner server details (name -> IP) from the server inventory."""
+    # Plain JSON inventory written by create_hetzner_servers.py (no pandas import needed)
+    if os.path.exists(SERVERS_FILE):
+        try:
+            with open(SERVERS_FILE, "r") as f:
+                return {server["Name"]: server["IP"] for server in json.load(f)}
+        except (json.JSONDecodeError, KeyError) as e:
+            logging.error(f"Error loading server details from '{SERVERS_FILE}': {e}")
+            exit(1)
+
+    # Fall back to the Excel inventory of older deployments
     try:
-        df = pd.read_excel("output/hetzner_servers.xlsx")
+        import pandas as pd
+        df = pd.read_excel(SERVERS_EXCEL_FILE)
         return dict(zip(df["Name"], df["IP"]))
     except FileNotFoundError:
         logging.error("Hetzner servers file not found.")
@@ -67,40 +106,89 @@ def create_local_data_folder(descriptor):
     
     return local_path, logs_folder  # Return the main folder and logs folder
 
-def sync_data_from_server(ip_address, ssh_path, destination_path, local_data_path, logs_folder, batch_no, data_type):
+def parse_rsync_stats(output):
+    """Extract the number of transferred files and bytes from rsync --stats output."""
+    stats = {"files": 0, "bytes": 0}
+    files = re.search(r"Number of (?:regular )?files transferred: ([\d,.]+)", output)
+    size = re.search(r"Total transferred file size: ([\d,.]+)", output)
+    if files:
+        stats["files"] = int(re.sub(r"[,.]", "", files.group(1)))
+    if size:
+        stats["bytes"] = int(re.sub(r"[,.]", "", size.group(1)))
+    return stats
+
+def run_rsync(command, description, retries=RSYNC_RETRIES, input=None, partial_ok=False):
+    """Run rsync quietly with retries and backoff; return its transfer stats.
+
+    With partial_ok, a run that skipped some files (exit 23) counts as done: retrying cannot bring them back.
+    """
+    for attempt in range(1, retries + 1):
+        result = subprocess.run(command, capture_output=True, text=True, input=input)
+        if result.returncode == 0 or result.returncode == RSYNC_PARTIAL_VANISHED:
+            return parse_rsync_stats(result.stdout)
+        if result.returncode == RSYNC_PARTIAL_TRANSFER and partial_ok:
+            skipped = [line for line in result.stderr.strip().splitlines() if "rsync error" not in line]
+            logging.warning(f"{description}: {len(skipped)} files could not be transferred: "
+                            f"{'; '.join(skipped[:3])}")
+            return parse_rsync_stats(result.stdout)
+
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        if attempt < retries:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            logging.warning(f"{description} failed (attempt {attempt}/{retries}): {error}. Retrying in {delay}s...")
+            time.sleep(delay)
+        else:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, error)
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def sync_data_from_server(server_name, ip_address, ssh_path, destination_path, local_data_path, logs_folder, data_type,
+                          ssh_command=None):
     """Uses rsync to sync data from remote servers to the local data folder."""
+    batch_no = server_name.split("-")[-1]  # Batch number from server name
+    ssh_command = ssh_command or f"ssh -i {ssh_path}"
     remote_path = f"root@{ip_address}:{destination_path}"
     
     # Define the remote folders and files to sync
     remote_data_folder = os.path.join(remote_path, data_type)  # e.g., tweets, user_infos, or user_tweets
     remote_log_file = os.path.join(remote_path, f"logs/{data_type}_{batch_no}.log")
 
-    local_data_folder = os.path.join(local_data_path, data_type)
+    # Every server names its segments the same way (tweets_000001.jsonl), so each one gets its own subfolder
+    local_data_folder = os.path.join(local_data_path, data_type, server_name)
     local_log_file = os.path.join(logs_folder, f"{data_type}_{batch_no}.log")
 
     os.makedirs(local_data_folder, exist_ok=True)
 
-    # Rsync command for data folder
+    # Rsync command for data folder (segments still being written are skipped)
     rsync_command = [
-        "rsync", "-avz", "-e", f"ssh -i {ssh_path}",
+        "rsync", "-az", "--stats", "-e", ssh_command, *RSYNC_EXCLUDES,
         remote_data_folder + "/", local_data_folder + "/"
     ]
 
     # Rsync command for log file
     rsync_log_command = [
-        "rsync", "-avz", "-e", f"ssh -i {ssh_path}",
+        "rsync", "-az", "-e", ssh_command,
         remote_log_file, local_log_file
     ]
 
     # Execute rsync for data folder
     logging.info(f"Syncing {data_type} data from {ip_address} (batch {batch_no})...")
-    subprocess.run(rsync_command, check=True)
+    stats = run_rsync(rsync_command, f"Syncing {data_type} data from {ip_address}")
     
-    # Execute rsync for log file
-    logging.info(f"Syncing {data_type} log file from {ip_address}...")
-    subprocess.run(rsync_log_command, check=True)
+    # Execute rsync for log file (a missing log does not fail the server)
+    try:
+        run_rsync(rsync_log_command, f"Syncing {data_type} log file from {ip_address}")
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"Could not sync {data_type} log file from {ip_address}: {e.stderr}")
+
+    return stats
 
-def main(data_type, descriptor):
+def main(data_type, descriptor, workers=MAX_WORKERS):
     """Main function to sync data from remote servers."""
     config = load_config()
     servers = load_server_details()
@@ -109,20 +197,205 @@ def main(data_type, descriptor):
 
     local_data_path, logs_folder = create_local_data_folder(descriptor)
 
-    for server_name, ip_address in servers.items():
-        batch_no = server_name.split("-")[-1]  # Extract batch number from server name
-        try:
-            sync_data_from_server(ip_address, ssh_path, destination_path, local_data_path, logs_folder, batch_no, data_type)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error syncing data from {ip_address}: {e}")
+    # Gather servers in parallel; retries of one server only block its own thread
+    results = {}
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(sync_data_from_server, server_name, ip_address, ssh_path, destination_path,
+                            local_data_path, logs_folder, data_type): server_name
+            for server_name, ip_address in servers.items()
+        }
+        for future in as_completed(futures):
+            server_name = futures[future]
+            try:
+                results[server_name] = future.result()
+            except subprocess.CalledProcessError as e:
+                logging.error(f"Error syncing data from {servers[server_name]}: {e.stderr}")
+                results[server_name] = None
+
+            done = len(results)
+            total_files = sum(stats["files"] for stats in results.values() if stats)
+            total_bytes = sum(stats["bytes"] for stats in results.values() if stats)
+            status = "failed" if results[server_name] is None else "done"
+            logging.info(f"[{done}/{len(servers)}] {server_name} {status}. Fleet total so far: {total_files} files, "
+                         f"{format_bytes(total_bytes)} in {time.time() - start_time:.0f}s")
+
+    # Per-server summary
+    logging.info("Gather summary:")
+    for server_name in sorted(results):
+        stats = results[server_name]
+        if stats is None:
+            logging.error(f"  {server_name} ({servers[server_name]}): FAILED")
+        else:
+            logging.info(f"  {server_name} ({servers[server_name]}): {stats['files']} files, "
+                         f"{format_bytes(stats['bytes'])}")
 
+    failed = [server_name for server_name, stats in results.items() if stats is None]
+    if failed:
+        logging.error(f"{len(failed)} of {len(servers)} servers failed: {', '.join(sorted(failed))}")
     logging.info(f"Data gathering completed. Files stored in: {local_data_path}")
 
+    # Record the gathered IDs so later batches can leave them out (split_id_batches.py --exclude-collected)
+    add_gathered_folder(local_data_path, data_type)
+
+def read_remote_manifest(ip_address, ssh_args, destination_path, data_type, offset):
+    """Return the sealed files listed in the remote manifest past offset, and the new offset."""
+    manifest_path = os.path.join(destination_path, data_type, MANIFEST_FILE)
+    command = f"tail -c +{offset + 1} {shlex.quote(manifest_path)} 2>/dev/null"
+    result = subprocess.run(ssh_args + [f"root@{ip_address}", command], capture_output=True)
+    if result.returncode == SSH_CONNECTION_ERROR:
+        raise subprocess.CalledProcessError(result.returncode, command, result.stdout,
+                                            result.stderr.decode(errors="replace").strip())
+    if result.returncode != 0:
+        return [], offset  # No manifest yet
+
+    # Only complete lines: the remote script may be appending right now
+    cut = result.stdout.rfind(b"\n") + 1
+    return result.stdout[:cut].decode("utf-8").split(), offset + cut
+
+def pull_new_files(server_name, ip_address, ssh_args, destination_path, local_data_path, logs_folder, data_type,
+                   offset):
+    """Pull the files sealed on a server since the last poll; returns (stats, new_offset, pulled paths or None).
+
+    Pulled paths are relative to the local data type folder (<server_name>/<file>).
+    """
+    ssh_command = " ".join(ssh_args)
+    batch_no = server_name.split("-")[-1]  # Batch number from server name
+
+    if offset is None:
+        # First poll: read the manifest position, then do one full sync that covers everything before it
+        _, new_offset = read_remote_manifest(ip_address, ssh_args, destination_path, data_type, 0)
+        stats = sync_data_from_server(server_name, ip_address, None, destination_path, local_data_path, logs_folder,
+                                      data_type, ssh_command)
+        return stats, new_offset, None
+
+    filenames, new_offset = read_remote_manifest(ip_address, ssh_args, destination_path, data_type, offset)
+    if not filenames:
+        return {"files": 0, "bytes": 0}, new_offset, []
+
+    remote_data_folder = f"root@{ip_address}:{os.path.join(destination_path, data_type)}/"
+    local_data_folder = os.path.join(local_data_path, data_type, server_name)
+    os.makedirs(local_data_folder, exist_ok=True)
+
+    # Only the listed files are transferred, so the cost does not grow with the remote folder
+    rsync_command = ["rsync", "-az", "--stats", "-e", ssh_command, "--files-from=-",
+                     remote_data_folder, local_data_folder + "/"]
+    # A listed file that no longer exists (e.g. removed on the server) is skipped instead of blocking the offset
+    stats = run_rsync(rsync_command, f"Pulling {len(filenames)} new {data_type} files from {ip_address}",
+                      input="\n".join(dict.fromkeys(filenames)) + "\n", partial_ok=True)
+    filenames = [os.path.join(server_name, name) for name in filenames
+                 if os.path.exists(os.path.join(local_data_folder, name))]
+
+    # Keep the log file current as well
+    rsync_log_command = ["rsync", "-az", "-e", ssh_command,
+                         f"root@{ip_address}:{os.path.join(destination_path, f'logs/{data_type}_{batch_no}.log')}",
+                         os.path.join(logs_folder, f"{data_type}_{batch_no}.log")]
+    try:
+        run_rsync(rsync_log_command, f"Syncing {data_type} log file from {ip_address}", retries=1)
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"Could not sync {data_type} log file from {ip_address}: {e.stderr}")
+
+    return stats, new_offset, filenames
+
+def load_manifest_offsets(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_manifest_offsets(path, offsets):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(offsets, f, indent=2)
+    os.replace(tmp_path, path)
+
+def watch(data_type, descriptor, workers=MAX_WORKERS, interval=WATCH_INTERVAL):
+    """Keep pulling newly sealed files from every server until interrupted."""
+    config = load_config()
+    servers = load_server_details()
+    ssh_path = config["ssh_path"]
+    destination_path = config["destination_path"]
+
+    local_data_path, logs_folder = create_local_data_folder(descriptor)
+
+    # Manifest position per server, so a restarted watch continues where it stopped (also on a later day)
+    os.makedirs(WATCH_STATE_FOLDER, exist_ok=True)
+    offsets_path = os.path.join(WATCH_STATE_FOLDER, f"{descriptor}_{data_type}_manifest_offsets.json")
+    offsets = load_manifest_offsets(offsets_path)
+
+    # One shared SSH connection per server is reused by every poll
+    control_dir = tempfile.mkdtemp(prefix="ssh-mux-")
+    ssh_args = ["ssh", "-i", ssh_path, "-o", "ControlMaster=auto",
+                "-o", f"ControlPath={os.path.join(control_dir, '%C')}", "-o", f"ControlPersist={CONTROL_PERSIST}"]
+
+    logging.info(f"Watching {len(servers)} servers for new {data_type} files every {interval}s. Press Ctrl+C to stop.")
+    poll_no = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                poll_no += 1
+                futures = {
+                    executor.submit(pull_new_files, server_name, ip_address, ssh_args, destination_path,
+                                    local_data_path, logs_folder, data_type, offsets.get(server_name)): server_name
+                    for server_name, ip_address in servers.items()
+                }
+
+                new_files, new_bytes, failed = 0, 0, []
+                pulled, full_sync = [], False
+                for future in as_completed(futures):
+                    server_name = futures[future]
+                    try:
+                        stats, offsets[server_name], filenames = future.result()
+                    except subprocess.CalledProcessError as e:
+                        logging.error(f"Error polling {servers[server_name]}: {e.stderr}")
+                        failed.append(server_name)
+                        continue
+                    new_files += stats["files"]
+                    new_bytes += stats["bytes"]
+                    if filenames is None:
+                        full_sync = True
+                    else:
+                        pulled.extend(filenames)
+
+                save_manifest_offsets(offsets_path, offsets)
+                message = f"Poll {poll_no}: {new_files} new files, {format_bytes(new_bytes)}"
+                if failed:
+                    message += f" ({len(failed)} servers failed: {', '.join(sorted(failed))})"
+                logging.info(message)
+
+                # Only the newly pulled files are read, unless a server was fully synced
+                if full_sync or pulled:
+                    add_gathered_folder(local_data_path, data_type, None if full_sync else pulled)
+
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info(f"Watch stopped. Files stored in: {local_data_path}")
+    finally:
+        for ip_address in servers.values():
+            subprocess.run(ssh_args + ["-O", "exit", f"root@{ip_address}"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(control_dir, ignore_errors=True)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Gather collected data from remote servers using rsync.")
-    parser.add_argument("--data", required=True, choices=["tweets", "user_infos", "user_tweets"],
-                        help="Type of data to retrieve (tweets, user_infos, user_tweets).")
+    parser.add_argument("--data", required=True, choices=["tweets", "user_infos", "user_tweets", "keyword_tweets"],
+                        help="Type of data to retrieve (tweets, user_infos, user_tweets, keyword_tweets).")
     parser.add_argument("--desc", required=True, help="Short descriptor for the data folder.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Number of servers to gather from in parallel (default: {MAX_WORKERS}).")
+
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep pulling newly sealed files listed in the remote manifests until stopped.")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL,
+                        help=f"Seconds between manifest polls in watch mode (default: {WATCH_INTERVAL}).")
 
     args = parser.parse_args()
-    main(args.data, args.desc)
+    if args.workers < 1:
+        logging.error("--workers must be a positive integer.")
+        exit(1)
+
+    if args.watch:
+        watch(args.data, args.desc, args.workers, args.interval)
+    else:
+        main(args.data, args.desc, args.workers)
@@ -0,0 +1,402 @@
+import argparse
+import hmac
+import json
+import os
+import secrets
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# The ID parsing and lookup helpers are shared with the remote scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remote-scripts"))
+from id_arrays import parse_id_file
+
+# Logging setup
+LOG_FILE = "logs/lease_coordinator.log"
+os.makedirs("logs", exist_ok=True)
+
+logging.basicConfig(
+    filename=LOG_FILE,
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s [%(levelname)s] - %(message)s", "%Y-%m-%d %H:%M:%S")
+console_handler.setFormatter(formatter)
+logging.getLogger().addHandler(console_handler)
+
+JOB_TYPES = ("tweets", "user_infos", "user_tweets")
+LEASE_FOLDER = "output/leases"
+DB_PATH = os.path.join(LEASE_FOLDER, "leases.db")
+TOKEN_PATH = os.path.join(LEASE_FOLDER, "token")  # Shared secret the servers send with every request
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Per job type: seconds a lease lasts unless the worker renews it, and the smallest lease handed out.
+# A single user_tweets ID pages through a whole timeline, so those leases start at one user.
+LEASE_SETTINGS = {
+    "tweets": {"lease_seconds": 600, "min_size": 50},
+    "user_infos": {"lease_seconds": 600, "min_size": 50},
+    "user_tweets": {"lease_seconds": 1800, "min_size": 1},
+}
+TARGET_LEASE_SECONDS = 120  # Lease size aims at this much work for the worker's measured speed
+MAX_LEASE_SIZE = 20_000
+
+
+# Database
+def connect(db_path=DB_PATH):
+    """Open the lease database, creating its tables if needed."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_type TEXT PRIMARY KEY,
+            ids_path TEXT NOT NULL,
+            total INTEGER NOT NULL
+        );
+        -- Work is tracked as ranges of positions in the job's sorted ID array; a lease is one range
+        CREATE TABLE IF NOT EXISTS ranges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            issued_at REAL,
+            expires_at REAL,
+            completed_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS ranges_status ON ranges (job_type, status, start);
+        -- Speeds differ a lot between job types, so they are measured per worker and job type
+        CREATE TABLE IF NOT EXISTS workers (
+            worker TEXT NOT NULL,
+            job_type TEXT NOT NULL,
+            rate REAL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            expired INTEGER NOT NULL DEFAULT 0,
+            last_seen REAL,
+            PRIMARY KEY (worker, job_type)
+        );
+    """)
+    conn.commit()
+    return conn
+
+
+def load_token(path=TOKEN_PATH):
+    """Read the shared token, creating a random one (readable by the owner only) on first use."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_urlsafe(32))
+        logging.info(f"Created a new coordinator token in '{path}'.")
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+# Load IDs
+def load_job(conn, job_type, input_files):
+    """Deduplicate the input IDs and make them available for leasing, replacing earlier work of the job type."""
+    ids = np.unique(np.concatenate([parse_id_file(path) for path in input_files]))
+
+    # Each load gets its own file, so a running server never pairs the new IDs with the old ranges
+    ids_path = os.path.join(LEASE_FOLDER, f"{job_type}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.npy")
+    np.save(f"{ids_path}.tmp.npy", ids)
+    os.replace(f"{ids_path}.tmp.npy", ids_path)
+
+    previous = conn.execute("SELECT ids_path FROM jobs WHERE job_type = ?", (job_type,)).fetchone()
+    with conn:
+        conn.execute("DELETE FROM ranges WHERE job_type = ?", (job_type,))
+        conn.execute("INSERT OR REPLACE INTO jobs (job_type, ids_path, total) VALUES (?, ?, ?)",
+                     (job_type, ids_path, len(ids)))
+        if len(ids):
+            conn.execute("INSERT INTO ranges (job_type, start, end) VALUES (?, 0, ?)", (job_type, len(ids)))
+    if previous is not None and previous["ids_path"] != ids_path and os.path.exists(previous["ids_path"]):
+        os.remove(previous["ids_path"])  # A server that still maps it keeps reading it until it reopens
+    logging.info(f"Loaded {len(ids)} unique {job_type} IDs for leasing.")
+
+
+# Leasing
+class Coordinator:
+    """Hands out ranges of IDs to workers, sized by each worker's measured speed."""
+
+    def __init__(self, conn, lease_seconds=None):
+        self.conn = conn
+        self.lease_seconds = lease_seconds  # Overrides the per job type lease duration
+        self.lock = threading.Lock()  # One lease transaction at a time
+        self.ids = {}  # job_type -> (ids_path, mtime, memory-mapped ID array)
+
+    def _job_ids(self, job_type):
+        """Memory-mapped ID array of a job type, reopened after `load` replaced it while the server runs."""
+        job = self.conn.execute("SELECT ids_path FROM jobs WHERE job_type = ?", (job_type,)).fetchone()
+        if job is None:
+            return None
+        mtime = os.stat(job["ids_path"]).st_mtime_ns
+        cached = self.ids.get(job_type)
+        if cached is None or cached[:2] != (job["ids_path"], mtime):
+            self.ids[job_type] = (job["ids_path"], mtime, np.load(job["ids_path"], mmap_mode="r"))
+        return self.ids[job_type][2]
+
+    def lease_duration(self, job_type):
+        return self.lease_seconds or LEASE_SETTINGS[job_type]["lease_seconds"]
+
+    def update_rate(self, worker, job_type, rate, completed, now):
+        """Blend a new speed measurement into the worker's rate for the job type."""
+        self.conn.execute(
+            "UPDATE workers SET rate = CASE WHEN rate IS NULL THEN ? ELSE (rate + ?) / 2 END, "
+            "completed = completed + ?, last_seen = ? WHERE worker = ? AND job_type = ?",
+            (rate, rate, completed, now, worker, job_type)
+        )
+
+    def reclaim_expired(self, now):
+        """Put expired leases back in the pool and slow down the workers that held them."""
+        expired = self.conn.execute(
+            "SELECT id, worker, job_type FROM ranges WHERE status = 'leased' AND expires_at < ?", (now,)
+        ).fetchall()
+        for lease in expired:
+            self.conn.execute("UPDATE ranges SET status = 'pending', worker = NULL WHERE id = ?", (lease["id"],))
+            self.conn.execute(
+                "UPDATE workers SET expired = expired + 1, rate = rate / 2 WHERE worker = ? AND job_type = ?",
+                (lease["worker"], lease["job_type"])
+            )
+            logging.warning(f"Lease {lease['id']} ({lease['job_type']}) of {lease['worker']} expired and was reclaimed.")
+
+    def lease_size(self, job_type, worker):
+        """IDs to hand out so the worker finishes in about TARGET_LEASE_SECONDS."""
+        min_size = LEASE_SETTINGS[job_type]["min_size"]
+        row = self.conn.execute("SELECT rate FROM workers WHERE worker = ? AND job_type = ?",
+                                (worker, job_type)).fetchone()
+        if row is None or row["rate"] is None:
+            return min_size
+        return int(min(MAX_LEASE_SIZE, max(min_size, row["rate"] * TARGET_LEASE_SECONDS)))
+
+    def lease(self, job_type, worker):
+        """Lease the next pending range of IDs to a worker."""
+        with self.lock, self.conn:
+            now = time.time()
+            self.reclaim_expired(now)
+            ids = self._job_ids(job_type)
+            if ids is None:
+                return {"error": f"Unknown job type: {job_type}"}
+
+            self.conn.execute(
+                "INSERT INTO workers (worker, job_type, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker, job_type) DO UPDATE SET last_seen = excluded.last_seen", (worker, job_type, now)
+            )
+
+            pending = self.conn.execute(
+                "SELECT * FROM ranges WHERE job_type = ? AND status = 'pending' ORDER BY start LIMIT 1", (job_type,)
+            ).fetchone()
+            if pending is None:
+                leased = self.conn.execute(
+                    "SELECT COUNT(*) FROM ranges WHERE job_type = ? AND status = 'leased'", (job_type,)
+                ).fetchone()[0]
+                # Outstanding leases may still expire and come back, so workers retry until none are left
+                return {"lease_id": None, "ids": [], "outstanding": leased}
+
+            # Split the pending range when it is larger than this worker's lease
+            size = self.lease_size(job_type, worker)
+            end = min(pending["end"], pending["start"] + size)
+            if end < pending["end"]:
+                self.conn.execute("INSERT INTO ranges (job_type, start, end) VALUES (?, ?, ?)",
+                                  (job_type, end, pending["end"]))
+            lease_seconds = self.lease_duration(job_type)
+            expires_at = now + lease_seconds
+            self.conn.execute(
+                "UPDATE ranges SET end = ?, status = 'leased', worker = ?, issued_at = ?, expires_at = ? WHERE id = ?",
+                (end, worker, now, expires_at, pending["id"])
+            )
+
+        logging.info(f"Leased {end - pending['start']} {job_type} IDs to {worker} (lease {pending['id']}).")
+        return {"lease_id": pending["id"], "ids": ids[pending["start"]:end].tolist(), "expires_at": expires_at,
+                "lease_seconds": lease_seconds}
+
+    def renew(self, lease_id, worker, done=0):
+        """Extend a lease the worker is still processing and measure its speed from the IDs done so far."""
+        with self.lock, self.conn:
+            now = time.time()
+            lease = self.conn.execute("SELECT * FROM ranges WHERE id = ?", (lease_id,)).fetchone()
+            if lease is None:
+                return {"error": f"Unknown lease: {lease_id}"}
+            if lease["status"] != "leased" or lease["worker"] != worker:
+                # Already done, or expired and handed out again: the worker's copy is no longer tracked
+                return {"ok": False, "status": lease["status"]}
+
+            lease_seconds = self.lease_duration(lease["job_type"])
+            expires_at = now + lease_seconds
+            self.conn.execute("UPDATE ranges SET expires_at = ? WHERE id = ?", (expires_at, lease_id))
+            if done > 0:
+                self.update_rate(worker, lease["job_type"], done / max(now - lease["issued_at"], 1.0), 0, now)
+
+        logging.debug(f"{worker} renewed lease {lease_id} ({done} of {lease['end'] - lease['start']} IDs done).")
+        return {"ok": True, "expires_at": expires_at, "lease_seconds": lease_seconds}
+
+    def complete(self, lease_id, worker):
+        """Mark a lease as done and update the worker's measured speed."""
+        with self.lock, self.conn:
+            now = time.time()
+            lease = self.conn.execute("SELECT * FROM ranges WHERE id = ?", (lease_id,)).fetchone()
+            if lease is None:
+                return {"error": f"Unknown lease: {lease_id}"}
+            if lease["status"] == "done":
+                return {"ok": True}
+
+            # The work is done even if the lease expired meanwhile (a late duplicate is harmless)
+            self.conn.execute("UPDATE ranges SET status = 'done', completed_at = ? WHERE id = ?", (now, lease_id))
+
+            size = lease["end"] - lease["start"]
+            if lease["worker"] == worker and lease["issued_at"]:
+                rate = size / max(now - lease["issued_at"], 1.0)
+                self.update_rate(worker, lease["job_type"], rate, size, now)
+
+        logging.info(f"{worker} completed lease {lease_id} ({size} {lease['job_type']} IDs).")
+        return {"ok": True}
+
+    def status(self):
+        """Progress per job type and speed per worker."""
+        with self.lock:
+            jobs = {}
+            for job in self.conn.execute("SELECT * FROM jobs").fetchall():
+                counts = {"pending": 0, "leased": 0, "done": 0}
+                for row in self.conn.execute(
+                    "SELECT status, SUM(end - start) AS ids FROM ranges WHERE job_type = ? GROUP BY status",
+                    (job["job_type"],)
+                ):
+                    counts[row["status"]] = row["ids"]
+                jobs[job["job_type"]] = {"total": job["total"], **counts}
+
+            workers = {}
+            for row in self.conn.execute("SELECT * FROM workers ORDER BY worker, job_type"):
+                workers.setdefault(row["worker"], {})[row["job_type"]] = {
+                    "rate": round(row["rate"] or 0, 2), "completed": row["completed"],
+                    "expired": row["expired"], "last_seen": row["last_seen"]
+                }
+        return {"jobs": jobs, "workers": workers}
+
+
+# HTTP API
+class LeaseRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints: POST /lease, POST /renew, POST /complete, GET /status."""
+
+    coordinator = None
+    token = None
+
+    def _authorized(self):
+        """Check the shared token; requests without it are answered with 401."""
+        expected = f"Bearer {self.token}"
+        if hmac.compare_digest(self.headers.get("Authorization", ""), expected):
+            return True
+        logging.warning(f"Rejected unauthenticated request from {self.address_string()} to {self.path}.")
+        self._send({"error": "Unauthorized"}, 401)
+        return False
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._send(self.coordinator.status())
+        else:
+            self._send({"error": "Not found"}, 404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/lease":
+                response = self.coordinator.lease(request["job_type"], request["worker"])
+            elif self.path == "/renew":
+                response = self.coordinator.renew(int(request["lease_id"]), request["worker"],
+                                                  int(request.get("done", 0)))
+            elif self.path == "/complete":
+                response = self.coordinator.complete(int(request["lease_id"]), request["worker"])
+            else:
+                self._send({"error": "Not found"}, 404)
+                return
+        except (KeyError, ValueError) as e:
+            self._send({"error": f"Invalid request: {e}"}, 400)
+            return
+        self._send(response, 400 if "error" in response else 200)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, lease_seconds=None):
+    """Run the coordinator until interrupted."""
+    LeaseRequestHandler.coordinator = Coordinator(connect(), lease_seconds)
+    LeaseRequestHandler.token = load_token()
+    server = ThreadingHTTPServer((host, port), LeaseRequestHandler)
+    expiry = f"{lease_seconds}s" if lease_seconds else ", ".join(
+        f"{job_type} {settings['lease_seconds']}s" for job_type, settings in LEASE_SETTINGS.items())
+    logging.info(f"Lease coordinator listening on http://{host}:{port} (unrenewed leases expire after {expiry}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Lease coordinator stopped.")
+    finally:
+        server.server_close()
+
+
+def print_status():
+    """Print job progress and worker speeds from the lease database."""
+    status = Coordinator(connect()).status()
+    if not status["jobs"]:
+        print("No jobs loaded yet.")
+        return
+    for job_type, counts in status["jobs"].items():
+        print(f"{job_type:<12} total {counts['total']:>12}  done {counts['done']:>12}  "
+              f"leased {counts['leased']:>10}  pending {counts['pending']:>12}")
+    for worker, job_types in status["workers"].items():
+        for job_type, stats in job_types.items():
+            print(f"  {worker:<20} {job_type:<12} {stats['rate']:>10} IDs/s  completed {stats['completed']:>10}  "
+                  f"expired leases {stats['expired']}")
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hand out ID leases to remote workers on request.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser("load", help="Load ID files for a job type.")
+    load_parser.add_argument("job_type", choices=JOB_TYPES, help="Job type the IDs are for.")
+    load_parser.add_argument("input_files", nargs="+", help="Newline-separated ID files.")
+
+    serve_parser = subparsers.add_parser("serve", help="Run the coordinator.")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}).")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT}).")
+    serve_parser.add_argument("--lease-seconds", type=int, default=None,
+                              help="Seconds before a lease that is neither renewed nor completed is reclaimed "
+                                   "(default: 600, 1800 for user_tweets).")
+
+    subparsers.add_parser("status", help="Show job progress and worker speeds.")
+
+    args = parser.parse_args()
+
+    if args.command == "load":
+        for path in args.input_files:
+            if not os.path.exists(path):
+                logging.error(f"Input file '{path}' not found.")
+                sys.exit(1)
+        load_job(connect(), args.job_type, args.input_files)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.lease_seconds)
+    else:
+        print_status()
@@ -1,9 +1,11 @@
 import argparse
-import pandas as pd
+import io
 import os
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fabric import Connection
+import shlex
 import sys
 
 # Logging setup
@@ -25,6 +27,31 @@ logging.getLogger().addHandler(console_handler)
 
 # Load configuration
 CONFIG_PATH = "config/config.json"
+SERVERS_FILE = "output/hetzner_servers.json"
+SERVERS_EXCEL_FILE = "output/hetzner_servers.xlsx"
+
+MAX_WORKERS = 20  # Servers contacted at the same time
+LEASE_TOKEN_PATH = "output/leases/token"  # Created by scripts/lease_coordinator.py serve
+REMOTE_LEASE_TOKEN_FILE = "lease_token"  # Read by remote-scripts/lease_client.py
+
+# Log file prefix and output folders of each remote script, used by --status
+SCRIPT_LOGS = {
+    "login": "login",
+    "get_tweet_info": "tweets",
+    "get_user_info": "user_infos",
+    "get_user_tweets": "user_tweets",
+    "get_keyword_tweets": "keyword_tweets",
+    "run_jobs": "jobs",
+}
+SCRIPT_OUTPUTS = {
+    "login": [],
+    "get_tweet_info": ["tweets"],
+    "get_user_info": ["user_infos"],
+    "get_user_tweets": ["user_tweets"],
+    "get_keyword_tweets": ["keyword_tweets"],
+    "run_jobs": ["tweets", "user_infos", "user_tweets"],
+    "worker_daemon": ["tweets", "user_infos", "user_tweets"],
+}
 
 def load_config():
     """Loads configuration from config.json."""
@@ -39,9 +66,20 @@ def load_config():
         sys.exit(1)
 
 def load_server_details():
-    """Loads Hetzner server details from the Excel file."""
+    """Loads Hetzner server details (name -> IP) from the server inventory."""
+    # Plain JSON inventory written by create_hetzner_servers.py (no pandas import needed)
+    if os.path.exists(SERVERS_FILE):
+        try:
+            with open(SERVERS_FILE, "r") as f:
+                return {server["Name"]: server["IP"] for server in json.load(f)}
+        except (json.JSONDecodeError, KeyError) as e:
+            logging.error(f"Error loading server details from '{SERVERS_FILE}': {e}")
+            sys.exit(1)
+
+    # Fall back to the Excel inventory of older deployments
     try:
-        df = pd.read_excel("output/hetzner_servers.xlsx")
+        import pandas as pd
+        df = pd.read_excel(SERVERS_EXCEL_FILE)
         return dict(zip(df["Name"], df["IP"]))
     except FileNotFoundError:
         logging.error("Hetzner servers file not found.")
@@ -51,47 +89,232 @@ def load_server_details():
         sys.exit(1)
 
 def run_remote_command(ip_address, ssh_path, command):
-    """Runs a command on a remote server using SSH."""
+    """Runs a command on a remote server using SSH. Returns True on success."""
     try:
-        conn = Connection(
+        with Connection(
             host=ip_address,
             user="root",
             connect_kwargs={"key_filename": ssh_path}
-        )
-        conn.run(command)
+        ) as conn:
+            conn.run(command)
         logging.info(f"Executed command on {ip_address}: {command}")
+        return True
     except Exception as e:
         logging.error(f"Failed to execute command on {ip_address}: {e}")
+        return False
 
-def execute_script_on_server(ip_address, ssh_path, destination_path, script_name, batch_no):
+def upload_lease_token(ip_address, ssh_path, destination_path, token):
+    """Copy the coordinator token to the server, readable by root only. Returns True on success."""
+    remote_path = f"{destination_path}/{REMOTE_LEASE_TOKEN_FILE}"
+    try:
+        with Connection(
+            host=ip_address,
+            user="root",
+            connect_kwargs={"key_filename": ssh_path}
+        ) as conn:
+            conn.put(io.BytesIO(token.encode("utf-8")), remote=remote_path)
+            conn.run(f"chmod 600 {remote_path}")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to upload the coordinator token to {ip_address}: {e}")
+        return False
+
+def execute_script_on_server(ip_address, ssh_path, destination_path, script_name, batch_no, script_args=""):
     """Executes a Python script inside a screen session on a remote server."""
     screen_session = script_name.replace(".py", "")
     
     command = (
         f"screen -dmS {screen_session} bash -c 'cd {destination_path} && "
-        f"python3 {script_name} {batch_no}; exec bash'"
+        f"python3 {script_name} {batch_no} {script_args}; exec bash'"
     )
     
-    run_remote_command(ip_address, ssh_path, command)
+    return run_remote_command(ip_address, ssh_path, command)
+
+def launch_on_server(server_name, ip_address, ssh_path, destination_path, script, script_args, submit,
+                     lease_token=None):
+    """Start (or submit) the selected script on one server."""
+    batch_no = server_name.split("-")[-1]  # Extract batch number from server name
+
+    # The token is copied as a file so it does not show up in the remote command line
+    if lease_token and not upload_lease_token(ip_address, ssh_path, destination_path, lease_token):
+        return False
+
+    if script == "worker_daemon":
+        # The daemon serves jobs for every batch, so it is started with the "serve" command instead
+        logging.info(f"Starting worker_daemon.py on {server_name} ({ip_address})")
+        return execute_script_on_server(ip_address, ssh_path, destination_path, "worker_daemon.py", "serve")
+    elif submit:
+        logging.info(f"Submitting {script} job for batch {batch_no} to the worker daemon on {server_name} ({ip_address})")
+        # The job keeps its options (e.g. --coordinator, --ttl-hours) in the daemon's queue
+        return run_remote_command(ip_address, ssh_path,
+                                  f"cd {destination_path} && python3 {script}.py {batch_no} --submit {script_args}".strip())
+    else:
+        logging.info(f"Starting {script}.py on {server_name} ({ip_address}) with batch {batch_no}")
+        return execute_script_on_server(ip_address, ssh_path, destination_path, f"{script}.py", batch_no, script_args)
+
+def build_status_command(destination_path, script, batch_no):
+    """Shell command printing key=value status lines for a script on one server."""
+    log_file = "logs/worker_daemon.log" if script == "worker_daemon" else f"logs/{SCRIPT_LOGS[script]}_{batch_no}.log"
+    # "[p]ython3" keeps pgrep from matching the shell that runs this command
+    lines = [
+        f"cd {shlex.quote(destination_path)} || exit 1",
+        f"screen -ls 2>/dev/null | grep -q '[.]{script}[[:space:]]' && echo screen=yes || echo screen=no",
+        f"pgrep -f '[p]ython3 {script}.py' >/dev/null && echo process=yes || echo process=no",
+        f"echo \"last_log=$(tail -n 1 {log_file} 2>/dev/null)\"",
+    ]
+    # The checkpoint holds one int64 per collected ID, so its size gives the count without listing the folder.
+    # It only grows when a segment is sealed, so the index lines of the open segments are added.
+    for folder in SCRIPT_OUTPUTS[script]:
+        lines.append(
+            f"echo \"{folder}=$(( ($(stat -c %s {folder}/.collected_ids 2>/dev/null || echo 0) + "
+            f"$(stat -c %s {folder}/.collected_log 2>/dev/null || echo 0)) / 8 + "
+            f"$(cat {folder}/*.idx.open 2>/dev/null | wc -l) ))\""
+        )
+    return "\n".join(lines)
+
+def check_server_status(server_name, ip_address, ssh_path, destination_path, script):
+    """Check whether the script is running on a server, its last log line and its output counts."""
+    batch_no = server_name.split("-")[-1]
+    with Connection(
+        host=ip_address,
+        user="root",
+        connect_kwargs={"key_filename": ssh_path}
+    ) as conn:
+        result = conn.run(build_status_command(destination_path, script, batch_no), hide=True, warn=True)
 
-def main(script):
+    status = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition("=")
+        status[key] = value.strip()
+    return status
+
+def print_status(script, workers=MAX_WORKERS):
+    """Check every server in parallel and log one status line per server."""
+    config = load_config()
+    servers = load_server_details()
+    ssh_path = config["ssh_path"]
+    destination_path = config["destination_path"]
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(check_server_status, server_name, ip_address, ssh_path, destination_path, script): server_name
+            for server_name, ip_address in servers.items()
+        }
+        for future in as_completed(futures):
+            server_name = futures[future]
+            try:
+                statuses[server_name] = future.result()
+            except Exception as e:
+                statuses[server_name] = {"error": str(e)}
+
+    running, totals = 0, {folder: 0 for folder in SCRIPT_OUTPUTS[script]}
+    logging.info(f"Status of {script}.py on {len(servers)} servers:")
+    for server_name in sorted(statuses):
+        status = statuses[server_name]
+        if "error" in status:
+            logging.error(f"  {server_name} ({servers[server_name]}): UNREACHABLE ({status['error']})")
+            continue
+
+        is_running = status.get("process") == "yes"
+        running += is_running
+        counts = []
+        for folder in totals:
+            count = int(status.get(folder) or 0)
+            totals[folder] += count
+            counts.append(f"{folder}={count}")
+
+        line = f"  {server_name} ({servers[server_name]}): {'RUNNING' if is_running else 'STOPPED'}"
+        if status.get("screen") == "yes" and not is_running:
+            line += " (screen open)"
+        if counts:
+            line += f" | {', '.join(counts)}"
+        line += f" | last log: {status.get('last_log') or '-'}"
+        logging.info(line)
+
+    summary = f"{running}/{len(servers)} servers running {script}.py"
+    if totals:
+        summary += " | totals: " + ", ".join(f"{folder}={count}" for folder, count in totals.items())
+    logging.info(summary)
+
+def main(script, jobs=None, submit=False, workers=MAX_WORKERS, coordinator=None, ttl_hours=None, harvest=False):
     """Main execution flow: Runs the selected script on all servers."""
     config = load_config()
     servers = load_server_details()
     ssh_path = config["ssh_path"]
     destination_path = config["destination_path"]
 
-    for server_name, ip_address in servers.items():
-        batch_no = server_name.split("-")[-1]  # Extract batch number from server name
+    # The combined runner takes the job types to interleave on each server
+    script_args = f"--jobs {' '.join(jobs)}" if script == "run_jobs" and jobs else ""
+    lease_token = None
+    if coordinator:
+        # The fetch scripts pull ID leases from the coordinator instead of reading their batch file
+        script_args = f"--coordinator {coordinator}"
+        if not os.path.exists(LEASE_TOKEN_PATH):
+            logging.error(f"Coordinator token '{LEASE_TOKEN_PATH}' not found. "
+                          "Start scripts/lease_coordinator.py serve first.")
+            sys.exit(1)
+        with open(LEASE_TOKEN_PATH, "r") as f:
+            lease_token = f.read().strip()
+    if ttl_hours is not None:
+        # Profiles fetched within the TTL are served from each server's profile cache
+        script_args = f"{script_args} --ttl-hours {ttl_hours}".strip()
+    if harvest:
+        # Users embedded in the collected tweets are copied instead of requested
+        script_args = f"{script_args} --harvest".strip()
 
-        logging.info(f"Starting {script}.py on {server_name} ({ip_address}) with batch {batch_no}")
-        execute_script_on_server(ip_address, ssh_path, destination_path, f"{script}.py", batch_no)
+    # Launch on all servers concurrently
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(launch_on_server, server_name, ip_address, ssh_path, destination_path,
+                            script, script_args, submit, lease_token): server_name
+            for server_name, ip_address in servers.items()
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    failed = sorted(server_name for server_name, ok in results.items() if not ok)
+    if failed:
+        logging.error(f"Failed to start {script} on {len(failed)} of {len(servers)} servers: {', '.join(failed)}")
+    logging.info(f"Started {script} on {len(servers) - len(failed)} of {len(servers)} servers.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run a remote Python script inside a screen session on all servers.")
-    parser.add_argument("--script", required=True, choices=["login", "get_tweet_info", "get_user_info", "get_user_tweets"],
-                        help="Specify which script to run (login, get_tweet_info, get_user_info, get_user_tweets)")
+    parser.add_argument("--script", required=True,
+                        choices=["login", "get_tweet_info", "get_user_info", "get_user_tweets", "get_keyword_tweets",
+                                 "run_jobs", "worker_daemon"],
+                        help="Specify which script to run (login, get_tweet_info, get_user_info, get_user_tweets, "
+                             "get_keyword_tweets, run_jobs, worker_daemon)")
+    parser.add_argument("--jobs", nargs="+", choices=["tweets", "user_infos", "user_tweets"],
+                        help="Job types for run_jobs to run together on each server (default: all).")
+    parser.add_argument("--submit", action="store_true",
+                        help="Queue the job on each server's worker daemon instead of starting a new process.")
+    parser.add_argument("--status", action="store_true",
+                        help="Check whether the script is running on every server instead of starting it.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Number of servers to contact in parallel (default: {MAX_WORKERS}).")
+    parser.add_argument("--coordinator", default=None,
+                        help="URL of the lease coordinator (scripts/lease_coordinator.py) the servers pull ID leases from.")
 
+    parser.add_argument("--ttl-hours", type=float, default=None,
+                        help="For get_user_info: only refetch profiles older than this (profile cache on each server).")
+    parser.add_argument("--harvest", action="store_true",
+                        help="For get_user_info: first copy the users embedded in collected tweets on each server.")
     args = parser.parse_args()
-    
-    main(args.script)
+
+    if args.submit and args.script not in ("get_tweet_info", "get_user_info", "get_user_tweets"):
+        parser.error("--submit is only supported for get_tweet_info, get_user_info and get_user_tweets.")
+    if args.coordinator and args.script not in ("get_tweet_info", "get_user_info", "get_user_tweets"):
+        parser.error("--coordinator is only supported for get_tweet_info, get_user_info and get_user_tweets.")
+    if args.ttl_hours is not None and args.script != "get_user_info":
+        parser.error("--ttl-hours is only supported for get_user_info.")
+    if args.harvest and args.script != "get_user_info":
+        parser.error("--harvest is only supported for get_user_info.")
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer.")
+
+    if args.status:
+        print_status(args.script, args.workers)
+    else:
+        main(args.script, args.jobs, args.submit, args.workers, args.coordinator, args.ttl_hours, args.harvest)
@@ -0,0 +1,366 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import shutil
+import tempfile
+import logging
+import numpy as np
+from collected_store import CollectedStore
+
+# The ID parsing and lookup helpers are shared with the remote scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remote-scripts"))
+from id_arrays import iter_id_blocks
+
+try:
+    import zstandard
+except ImportError:  # Only needed to read compressed user_infos segments
+    zstandard = None
+
+# Logging setup
+LOG_FILE = "logs/split_id_batches.log"
+os.makedirs("logs", exist_ok=True)
+
+logging.basicConfig(
+    filename=LOG_FILE,
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s [%(levelname)s] - %(message)s", "%Y-%m-%d %H:%M:%S")
+console_handler.setFormatter(formatter)
+logging.getLogger().addHandler(console_handler)
+
+# Output folder and file name of each batch type (as shipped by transfer_files.py)
+BATCH_TYPES = {
+    "tweet": ("output/tweet_batches", "tweet_ids"),
+    "user": ("output/user_batches", "user_ids"),
+}
+
+# Collected store data types whose IDs can be excluded from each batch type
+EXCLUDE_TYPES = {
+    "tweet": ("tweets",),
+    "user": ("user_infos", "user_tweets"),
+}
+
+RUN_SIZE = 10_000_000  # IDs sorted in memory at a time (80 MB as int64)
+MERGE_BUFFER_SIZE = 1_000_000  # IDs read from each sorted run per merge step
+
+# Cost model of get_user_tweets.py: one request per page of ~20 tweets, up to 3200 tweets per user
+TWEET_LIMIT = 3200
+TWEETS_PER_PAGE = 20
+
+
+# Sort and deduplicate
+def write_sorted_runs(input_files, tmp_folder, run_size=RUN_SIZE):
+    """Splits the input into sorted, deduplicated runs of at most run_size IDs saved as .npy files."""
+    run_paths = []
+    pending = []
+    pending_count = 0
+    total_ids = 0
+
+    def flush():
+        run = np.unique(np.concatenate(pending))
+        run_path = os.path.join(tmp_folder, f"run_{len(run_paths):05}.npy")
+        np.save(run_path, run)
+        run_paths.append(run_path)
+        logging.info(f"Wrote sorted run {len(run_paths)} with {len(run)} unique IDs")
+
+    for path in input_files:
+        logging.info(f"Reading IDs from {path}")
+        for ids in iter_id_blocks(path):
+            total_ids += len(ids)
+            # Cut blocks so that no run holds more than run_size IDs
+            while len(ids):
+                take = ids[:run_size - pending_count]
+                ids = ids[len(take):]
+                pending.append(take)
+                pending_count += len(take)
+                if pending_count >= run_size:
+                    flush()
+                    pending, pending_count = [], 0
+
+    if pending_count:
+        flush()
+
+    return run_paths, total_ids
+
+
+def merge_sorted_runs(run_paths, buffer_size=MERGE_BUFFER_SIZE):
+    """Yields the union of the sorted runs as sorted, deduplicated int64 chunks with bounded memory."""
+    runs = [np.load(path, mmap_mode="r") for path in run_paths]
+    positions = [0] * len(runs)
+    last_id = None
+
+    while True:
+        buffers = [(i, run[positions[i]:positions[i] + buffer_size]) for i, run in enumerate(runs)
+                   if positions[i] < len(run)]
+        if not buffers:
+            break
+
+        # Everything up to the smallest buffer end is complete in every run
+        bound = min(buffer[-1] for _, buffer in buffers)
+        parts = []
+        for i, buffer in buffers:
+            take = int(np.searchsorted(buffer, bound, side="right"))
+            parts.append(buffer[:take])
+            positions[i] += take
+
+        merged = np.unique(np.concatenate(parts))
+        if last_id is not None and len(merged) and merged[0] == last_id:
+            merged = merged[1:]
+        if len(merged):
+            last_id = merged[-1]
+            yield merged
+
+
+def exclude_collected(chunks, stores, excluded):
+    """Drops IDs found in any of the collected stores from the sorted chunks, counting them in excluded[0]."""
+    for chunk in chunks:
+        collected = np.zeros(len(chunk), dtype=bool)
+        for store in stores:
+            collected |= store.contains(chunk)
+        excluded[0] += int(collected.sum())
+        if not collected.all():
+            yield chunk[~collected]
+
+
+# Split into batches
+def split_into_batches(chunks, num_batches, output_folder, file_prefix):
+    """Deals the IDs round-robin into num_batches files numbered 001..N, so batch sizes differ by at most one."""
+    os.makedirs(output_folder, exist_ok=True)
+    file_names = [os.path.join(output_folder, f"{file_prefix}_{i + 1:03}.txt") for i in range(num_batches)]
+    files = [open(f"{file_name}.tmp", "w") for file_name in file_names]
+    counts = [0] * num_batches
+    offset = 0  # Number of IDs dealt so far
+
+    try:
+        for chunk in chunks:
+            for batch in range(num_batches):
+                # First element of this chunk that belongs to the batch
+                ids = chunk[(batch - offset) % num_batches::num_batches]
+                if len(ids):
+                    files[batch].write("\n".join(map(str, ids.tolist())) + "\n")
+                    counts[batch] += len(ids)
+            offset += len(chunk)
+    finally:
+        for f in files:
+            f.close()
+
+    for file_name, count in zip(file_names, counts):
+        os.replace(f"{file_name}.tmp", file_name)
+        logging.info(f"Created file: {file_name} with {count} IDs")
+
+    return counts
+
+
+# Cost-weighted balancing
+def glob_gathered(folder, pattern):
+    """Files matching the pattern in a gathered folder and in its per-server subfolders."""
+    return sorted(glob.glob(os.path.join(folder, pattern)) + glob.glob(os.path.join(folder, "*", pattern)))
+
+
+def iter_user_info_records(folder):
+    """Yields the user info JSON strings of a gathered user_infos folder (segments and per-ID files)."""
+    for path in glob_gathered(folder, "*.jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from f
+
+    for path in glob_gathered(folder, "*.jsonl.zst"):
+        if zstandard is None:
+            logging.warning(f"Skipping {path}: reading compressed segments requires the 'zstandard' package.")
+            continue
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            yield from reader.read().decode("utf-8").splitlines()
+
+    for path in glob_gathered(folder, "*.json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield f.read()
+
+
+def load_statuses_counts(user_info_folders):
+    """Reads statusesCount per user ID from previously gathered user_infos folders."""
+    statuses_counts = {}
+    invalid = 0
+    for folder in user_info_folders:
+        for record in iter_user_info_records(folder):
+            try:
+                user = json.loads(record)
+                statuses_counts[int(user["id"])] = int(user["statusesCount"])
+            except (ValueError, KeyError, TypeError):
+                invalid += 1
+    if invalid:
+        logging.warning(f"Skipped {invalid} unreadable user info records.")
+    logging.info(f"Loaded tweet counts of {len(statuses_counts)} users from {len(user_info_folders)} folders.")
+    return statuses_counts
+
+
+def estimate_costs(ids, statuses_counts):
+    """Estimates the timeline requests of each user; users without a profile get the average cost."""
+    known_ids = np.fromiter(statuses_counts.keys(), dtype=np.int64, count=len(statuses_counts))
+    known_counts = np.fromiter(statuses_counts.values(), dtype=np.int64, count=len(statuses_counts))
+    order = np.argsort(known_ids)
+    known_ids, known_counts = known_ids[order], known_counts[order]
+
+    # Pages of tweets plus the request that returns the last (empty) page
+    known_costs = -(-np.minimum(known_counts, TWEET_LIMIT) // TWEETS_PER_PAGE) + 1
+    default_cost = int(round(known_costs.mean())) if len(known_costs) else 1
+
+    costs = np.full(len(ids), default_cost, dtype=np.int64)
+    if len(known_ids):
+        positions = np.minimum(np.searchsorted(known_ids, ids), len(known_ids) - 1)
+        found = known_ids[positions] == ids
+        costs[found] = known_costs[positions[found]]
+        logging.info(f"Found tweet counts for {found.sum()} of {len(ids)} users; "
+                     f"the others are estimated at {default_cost} requests.")
+    return costs
+
+
+def fill_level(loads, cost, count):
+    """Number of equal-cost items per batch when each item goes to the least loaded batch (LPT)."""
+    # Smallest load level that takes at least count items when every batch is filled up to it
+    low, high = int(loads.min()), int(loads.max()) + math.ceil(count / len(loads)) * cost
+    while low < high:
+        level = (low + high) // 2
+        if np.maximum(0, -(-(level - loads) // cost)).sum() >= count:
+            high = level
+        else:
+            low = level + 1
+    items = np.maximum(0, -(-(low - loads) // cost))
+
+    # Take back the surplus from the batches that would end up heaviest
+    surplus = int(items.sum()) - count
+    if surplus:
+        heaviest = np.argsort(loads + items * cost, kind="stable")[::-1]
+        heaviest = heaviest[items[heaviest] > 0][:surplus]
+        items[heaviest] -= 1
+    return items
+
+
+def assign_by_cost(costs, num_batches):
+    """Assigns users to batches greedily by decreasing cost so that the total cost per batch is even."""
+    assignment = np.empty(len(costs), dtype=np.int32)
+    loads = np.zeros(num_batches, dtype=np.int64)
+
+    # Users with the same cost are interchangeable, so each cost level is placed in one vectorized step
+    for cost in np.unique(costs)[::-1]:
+        members = np.flatnonzero(costs == cost)
+        items = fill_level(loads, int(cost), len(members))
+        assignment[members] = np.repeat(np.arange(num_batches, dtype=np.int32), items)
+        loads += items * int(cost)
+
+    return assignment, loads
+
+
+def write_assigned_batches(ids, assignment, num_batches, output_folder, file_prefix):
+    """Writes each batch's IDs, numbered 001..N, to its batch file."""
+    os.makedirs(output_folder, exist_ok=True)
+    counts = []
+    for batch in range(num_batches):
+        file_name = os.path.join(output_folder, f"{file_prefix}_{batch + 1:03}.txt")
+        batch_ids = ids[assignment == batch]
+        with open(f"{file_name}.tmp", "w") as f:
+            for start in range(0, len(batch_ids), MERGE_BUFFER_SIZE):
+                f.write("\n".join(map(str, batch_ids[start:start + MERGE_BUFFER_SIZE].tolist())) + "\n")
+        os.replace(f"{file_name}.tmp", file_name)
+        counts.append(len(batch_ids))
+        logging.info(f"Created file: {file_name} with {len(batch_ids)} IDs")
+    return counts
+
+
+# Main execution
+def main(input_files, batch_type, num_batches, run_size=RUN_SIZE, balance="count", user_info_folders=(),
+         exclude_types=()):
+    """Deduplicates the input ID files and splits them into balanced batch files."""
+    output_folder, file_prefix = BATCH_TYPES[batch_type]
+    stores = [CollectedStore(data_type) for data_type in exclude_types]
+    excluded = [0]
+
+    tmp_folder = tempfile.mkdtemp(prefix="split_id_batches_", dir="output")
+    try:
+        run_paths, total_ids = write_sorted_runs(input_files, tmp_folder, run_size)
+        if not run_paths:
+            logging.warning("No IDs found in the input files. Exiting.")
+            return
+
+        if balance == "cost":
+            # Balancing by cost needs every unique ID (and its cost) in memory at once
+            ids = np.concatenate(list(exclude_collected(merge_sorted_runs(run_paths), stores, excluded)) or
+                                 [np.empty(0, dtype=np.int64)])
+            costs = estimate_costs(ids, load_statuses_counts(user_info_folders))
+            assignment, loads = assign_by_cost(costs, num_batches)
+            counts = write_assigned_batches(ids, assignment, num_batches, output_folder, file_prefix)
+            logging.info(f"Estimated timeline requests per batch: {loads.min()}-{loads.max()} "
+                         f"(total {loads.sum()}).")
+        else:
+            counts = split_into_batches(exclude_collected(merge_sorted_runs(run_paths), stores, excluded),
+                                        num_batches, output_folder, file_prefix)
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    if stores:
+        logging.info(f"Excluded {excluded[0]} IDs already collected ({', '.join(exclude_types)}).")
+    unique_ids = sum(counts) + excluded[0]
+    logging.info(f"Read {total_ids} IDs, {unique_ids} unique ({total_ids - unique_ids} duplicates removed). "
+                 f"Split {sum(counts)} into {num_batches} batches of {min(counts)}-{max(counts)} IDs "
+                 f"in '{output_folder}'.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicate ID files and split them into one batch file per server.")
+    parser.add_argument("input_files", nargs="+", help="Newline-separated ID files (any size).")
+    parser.add_argument("--type", required=True, choices=list(BATCH_TYPES),
+                        help="Batch type: tweet -> output/tweet_batches, user -> output/user_batches.")
+    parser.add_argument("--num-batches", type=int, required=True,
+                        help="Number of batch files to write (one per server, numbered 001..N).")
+    parser.add_argument("--run-size", type=int, default=RUN_SIZE,
+                        help=f"IDs sorted in memory at a time (default: {RUN_SIZE}).")
+    parser.add_argument("--balance", choices=["count", "cost"], default="count",
+                        help="Balance batches by number of IDs (default) or by estimated get_user_tweets.py "
+                             "requests, using tweet counts from gathered user_infos (user batches only).")
+    parser.add_argument("--user-infos", nargs="+", default=[],
+                        help="Gathered user_infos folders to read tweet counts from "
+                             "(default with --balance cost: data/*/user_infos).")
+    parser.add_argument("--exclude-collected", nargs="+", choices=list(EXCLUDE_TYPES["tweet"] + EXCLUDE_TYPES["user"]),
+                        default=[], metavar="DATA_TYPE",
+                        help="Leave out IDs already gathered into the collected store (scripts/collected_store.py) "
+                             "for these data types: tweets for tweet batches, user_infos and/or user_tweets "
+                             "for user batches.")
+    args = parser.parse_args()
+
+    if args.num_batches < 1 or args.run_size < 1:
+        logging.error("--num-batches and --run-size must be positive integers.")
+        sys.exit(1)
+
+    for path in args.input_files:
+        if not os.path.exists(path):
+            logging.error(f"Input file '{path}' not found.")
+            sys.exit(1)
+
+    invalid_types = set(args.exclude_collected) - set(EXCLUDE_TYPES[args.type])
+    if invalid_types:
+        logging.error(f"--exclude-collected for {args.type} batches takes {', '.join(EXCLUDE_TYPES[args.type])}.")
+        sys.exit(1)
+
+    user_info_folders = args.user_infos
+    if args.balance == "cost":
+        if args.type != "user":
+            logging.error("--balance cost is only supported for user batches.")
+            sys.exit(1)
+        user_info_folders = user_info_folders or sorted(glob.glob("data/*/user_infos"))
+        if not user_info_folders:
+            logging.warning("No user_infos folders found; every user gets the same estimated cost.")
+
+    os.makedirs("output", exist_ok=True)
+    try:
+        main(args.input_files, args.type, args.num_batches, args.run_size, args.balance, user_info_folders,
+             args.exclude_collected)
+    except ValueError as e:
+        logging.error(f"Invalid ID in the input files: {e}")
+        sys.exit(1)
@@ -1,11 +1,16 @@
 import json
-import pandas as pd
 import os
 import sys
 import glob
 import argparse
 import subprocess
 import logging
+import tempfile
+import hashlib
+import shlex
+import tarfile
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Logging setup
 LOG_FILE = "logs/transfer_files.log"
@@ -27,6 +32,11 @@ logging.getLogger().addHandler(console_handler)
 
 # Load configuration
 CONFIG_PATH = "config/config.json"
+SERVERS_FILE = "output/hetzner_servers.json"
+SERVERS_EXCEL_FILE = "output/hetzner_servers.xlsx"
+
+MAX_WORKERS = 10  # Servers receiving files at the same time
+CONTROL_PERSIST = 60  # Seconds an idle shared SSH connection stays open
 
 def load_config():
     try:
@@ -40,60 +50,214 @@ def load_config():
         sys.exit(1)
 
 def load_server_details():
+    """Loads Hetzner server details (name -> IP) from the server inventory."""
+    # Plain JSON inventory written by create_hetzner_servers.py (no pandas import needed)
+    if os.path.exists(SERVERS_FILE):
+        try:
+            with open(SERVERS_FILE, "r") as f:
+                return {server["Name"]: server["IP"] for server in json.load(f)}
+        except (json.JSONDecodeError, KeyError) as e:
+            logging.error(f"Error loading server details from '{SERVERS_FILE}': {e}")
+            sys.exit(1)
+
+    # Fall back to the Excel inventory of older deployments
     try:
-        df = pd.read_excel("output/hetzner_servers.xlsx")
+        import pandas as pd
+        df = pd.read_excel(SERVERS_EXCEL_FILE)
         return dict(zip(df["Name"], df["IP"]))
     except FileNotFoundError:
-        logging.error("Server details file 'output/hetzner_servers.xlsx' not found.")
+        logging.error(f"Server details file '{SERVERS_FILE}' not found.")
         sys.exit(1)
 
-def run_scp(sources, destination, server_ip, ssh_path):
+def ssh_multiplex_options(control_dir):
+    """SSH options that share one master connection per server between scp/ssh calls."""
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={os.path.join(control_dir, '%C')}",
+        "-o", f"ControlPersist={CONTROL_PERSIST}",
+    ]
+
+def close_master_connection(server_ip, ssh_path, ssh_options):
+    """Stop the shared SSH connection to a server, if one was opened."""
+    subprocess.run(["ssh", "-i", ssh_path] + ssh_options + ["-O", "exit", f"root@{server_ip}"],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def run_scp(sources, destination, server_ip, ssh_path, ssh_options=None):
     if isinstance(sources, str):
         sources = [sources]
-    scp_command = ["scp", "-i", ssh_path] + sources + [f"root@{server_ip}:{destination}"]
+    scp_command = ["scp", "-i", ssh_path] + (ssh_options or []) + sources + [f"root@{server_ip}:{destination}"]
     try:
         subprocess.run(scp_command, check=True)
         logging.info(f"Transferred {sources} → {server_ip}:{destination}")
+        return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Failed to transfer {sources} → {server_ip}:{destination}. Error: {e}")
+        return False
 
-def transfer_files(batch_types):
-    config = load_config()
-    servers = load_server_details()
+def plan_transfers(server_name, batch_types, python_scripts, config):
+    """List the (label, sources, destination) transfers a server should receive."""
+    source_path = config["source_path"]
+    destination_path = config["destination_path"]
+    server_idx = server_name.split("-")[-1]
+
+    transfers = []  # (label, sources, destination)
+    if "scripts" in batch_types and python_scripts:
+        transfers.append(("scripts", python_scripts, destination_path))
+
+    if "accounts" in batch_types:
+        transfers.append(("accounts", f"{source_path}output/twitter_accounts/twitter_accounts_{server_idx}.json",
+                          destination_path))
 
+    if "user" in batch_types or "all" in batch_types:
+        transfers.append(("user", f"{source_path}output/user_batches/user_ids_{server_idx}.txt", destination_path))
+
+    if "tweet" in batch_types or "all" in batch_types:
+        transfers.append(("tweet", f"{source_path}output/tweet_batches/tweet_ids_{server_idx}.txt", destination_path))
+
+    if "keyword" in batch_types or "all" in batch_types:
+        transfers.append(("keyword", f"{source_path}output/keyword_batches/keyword_batch_{server_idx}.json",
+                          f"{destination_path}keyword_batches/"))
+
+    return transfers
+
+def transfer_to_server(server_name, server_ip, batch_types, python_scripts, config, control_dir):
+    """Send every requested file type to one server over a single shared SSH connection."""
+    ssh_path = config["ssh_path"]
+    transfers = plan_transfers(server_name, batch_types, python_scripts, config)
+
+    ssh_options = ssh_multiplex_options(control_dir)
+    failed = []
+    try:
+        for label, sources, destination in transfers:
+            if not run_scp(sources, destination, server_ip, ssh_path, ssh_options):
+                failed.append(label)
+    finally:
+        close_master_connection(server_ip, ssh_path, ssh_options)
+
+    return len(transfers), 0, failed
+
+@lru_cache(maxsize=None)
+def file_sha256(path):
+    """SHA-256 of a local file (cached: scripts are the same for every server)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_remote_hashes(server_ip, ssh_path, ssh_options, remote_paths):
+    """Return {remote_path: sha256} for the files that already exist on the server."""
+    command = "sha256sum -- " + " ".join(shlex.quote(path) for path in remote_paths) + " 2>/dev/null"
+    # sha256sum exits non-zero when some files are missing, so the return code is ignored
+    result = subprocess.run(["ssh", "-i", ssh_path] + ssh_options + [f"root@{server_ip}", command],
+                            capture_output=True, text=True)
+    hashes = {}
+    for line in result.stdout.splitlines():
+        digest, _, path = line.partition("  ")
+        if path:
+            hashes[path] = digest
+    return hashes
+
+def bundle_to_server(server_name, server_ip, batch_types, python_scripts, config, control_dir):
+    """Send the changed files of a server as one tar.gz stream, unpacked remotely in a single SSH exec."""
     ssh_path = config["ssh_path"]
-    source_path = config["source_path"]
     destination_path = config["destination_path"]
 
-    logging.info(f"Starting file transfer: batch={batch_types}")
+    # Map every local file to its remote path
+    files = {}  # remote_path -> (label, local_path)
+    failed = []
+    for label, sources, destination in plan_transfers(server_name, batch_types, python_scripts, config):
+        for source in [sources] if isinstance(sources, str) else sources:
+            if not os.path.exists(source):
+                logging.error(f"File not found for {server_name}: {source}")
+                failed.append(label)
+                continue
+            files[os.path.join(destination, os.path.basename(source))] = (label, source)
 
-    if "scripts" in batch_types:
-        python_scripts = glob.glob(f"{source_path}remote-scripts/*.py")
-        if python_scripts:
-            for server_name, server_ip in servers.items():
-                run_scp(python_scripts, destination_path, server_ip, ssh_path)
+    ssh_options = ssh_multiplex_options(control_dir)
+    try:
+        # Skip files whose content is already on the server
+        remote_hashes = get_remote_hashes(server_ip, ssh_path, ssh_options, list(files)) if files else {}
+        changed = {remote_path: entry for remote_path, entry in files.items()
+                   if remote_hashes.get(remote_path) != file_sha256(entry[1])}
+        skipped = len(files) - len(changed)
+
+        if not changed:
+            logging.info(f"{server_name} ({server_ip}) is up to date ({skipped} files unchanged).")
+            return len(files), skipped, failed
+
+        # Paths in the archive are relative to the extraction root ("/" for absolute destinations)
+        extract_root = "/" if os.path.isabs(destination_path) else "."
+        remote_command = f"tar -xzf - --no-same-owner -C {extract_root}"
+        process = subprocess.Popen(["ssh", "-i", ssh_path] + ssh_options + [f"root@{server_ip}", remote_command],
+                                   stdin=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdin, mode="w|gz") as tar:
+                for remote_path, (label, local_path) in changed.items():
+                    tar.add(local_path, arcname=os.path.relpath(remote_path, extract_root))
+        except (BrokenPipeError, OSError) as e:
+            logging.error(f"Bundle stream to {server_ip} was interrupted: {e}")
+        finally:
+            process.stdin.close()
+            return_code = process.wait()
+
+        if return_code != 0:
+            logging.error(f"Failed to unpack the bundle on {server_ip} (exit code {return_code}).")
+            failed.extend(sorted({label for label, _ in changed.values()}))
         else:
-            logging.warning("No Python scripts found in remote-scripts.")
+            logging.info(f"Transferred {len(changed)} files in one bundle → {server_ip} ({skipped} unchanged)")
+    finally:
+        close_master_connection(server_ip, ssh_path, ssh_options)
 
-    if "accounts" in batch_types:
-        for server_name, server_ip in servers.items():
-            run_scp(f"{source_path}output/twitter_accounts/twitter_accounts_{server_name.split('-')[-1]}.json",
-                    destination_path, server_ip, ssh_path)
+    return len(files), skipped, failed
 
-    for server_name, server_ip in servers.items():
-        server_idx = server_name.split("-")[-1]
+def transfer_files(batch_types, workers=MAX_WORKERS, bundle=False):
+    config = load_config()
+    servers = load_server_details()
 
-        if "user" in batch_types or "all" in batch_types:
-            run_scp(f"{source_path}output/user_batches/user_ids_{server_idx}.txt", destination_path, server_ip, ssh_path)
+    source_path = config["source_path"]
+
+    logging.info(f"Starting file transfer: batch={batch_types}, servers={len(servers)}, workers={workers}")
+
+    python_scripts = []
+    if "scripts" in batch_types:
+        python_scripts = glob.glob(f"{source_path}remote-scripts/*.py")
+        if not python_scripts:
+            logging.warning("No Python scripts found in remote-scripts.")
 
-        if "tweet" in batch_types or "all" in batch_types:
-            run_scp(f"{source_path}output/tweet_batches/tweet_ids_{server_idx}.txt", destination_path, server_ip, ssh_path)
+    # One thread per server (bounded); each server reuses one SSH connection for all of its files
+    transfer = bundle_to_server if bundle else transfer_to_server
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ssh-mux-") as control_dir:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(transfer, server_name, server_ip, batch_types, python_scripts,
+                                config, control_dir): server_name
+                for server_name, server_ip in servers.items()
+            }
+            for future in as_completed(futures):
+                server_name = futures[future]
+                try:
+                    results[server_name] = future.result()
+                except Exception as e:
+                    logging.error(f"Transfer to {server_name} failed: {e}")
+                    results[server_name] = (None, 0, [str(e)])
 
-        if "keyword" in batch_types or "all" in batch_types:
-            run_scp(f"{source_path}output/keyword_batches/keyword_batch_{server_idx}.json",
-                    f"{destination_path}keyword_batches/", server_ip, ssh_path)
+    # Per-server summary
+    logging.info("Transfer summary:")
+    failed_servers = 0
+    for server_name in sorted(results):
+        total, skipped, failed = results[server_name]
+        if failed:
+            failed_servers += 1
+            logging.error(f"  {server_name} ({servers[server_name]}): FAILED {', '.join(failed)}")
+        elif bundle:
+            logging.info(f"  {server_name} ({servers[server_name]}): OK ({total - skipped} sent, {skipped} unchanged)")
+        else:
+            logging.info(f"  {server_name} ({servers[server_name]}): OK ({total} transfers)")
 
-    logging.info("File transfer process completed.")
+    logging.info(f"File transfer process completed: {len(results) - failed_servers} servers OK, "
+                 f"{failed_servers} with failures.")
 
 # CLI parsing
 if __name__ == "__main__":
@@ -105,5 +269,14 @@ if __name__ == "__main__":
         required=True,
         help="Specify which types of files to transfer."
     )
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Number of servers to transfer to in parallel (default: {MAX_WORKERS}).")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Send each server's changed files as one compressed tar stream (skips unchanged files).")
     args = parser.parse_args()
-    transfer_files(args.batch)
+
+    if args.workers < 1:
+        logging.error("--workers must be a positive integer.")
+        sys.exit(1)
+
+    transfer_files(args.batch, args.workers, args.bundle)